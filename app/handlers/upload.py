@@ -1,15 +1,30 @@
+import asyncio
+import io
+import time
+from typing import Awaitable, Callable
+
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram import Bot
 from pathlib import Path
 from tempfile import NamedTemporaryFile
 
-from app.services.analyzer import run_full_analysis
-from app.services.formatter import format_document_analysis
+from app.models.analysis import DocumentAnalysis, RiskLabel
+from app.models.events import AnalysisDone, AnalysisProgress, FragmentReady
+from app.services.analyzer import iter_full_analysis, run_full_analysis
+from app.services.formatter import format_document_analysis, format_fragment_analysis
+from app.services.job_queue import QueueFull, get_job_scheduler
+from app.services.result_cache import analyze_once, content_sha256, get_cached_by_file_id
+from app.services.text_extractor import DocumentSource
 from app.utils.text import split_text_for_telegram
+from config import settings
 
 router = Router(name="upload")
 
+TOPIC = "госпошлина"
+
+MB = 1024 * 1024
+
 
 @router.message(F.document)
 async def handle_document_upload(message: Message) -> None:
@@ -17,34 +32,275 @@ async def handle_document_upload(message: Message) -> None:
     if not document:
         return
 
-    await message.answer("Файл получил, начинаю проверку...")
-
-    bot: Bot = message.bot
+    status = await message.answer("Файл получил, начинаю проверку...")
 
-    # 1. Создаем временный файл (без сохранения на диск на постоянной основе)
+    # 1. Проверяем формат и размер файла
     suffix = Path(document.file_name).suffix.lower()
     if suffix not in {".pdf", ".docx"}:
         await message.answer("Поддерживаю только PDF и DOCX.")
         return
 
-    with NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp_path = Path(tmp.name)
-        await bot.download(document, destination=tmp)
+    # 1.0. Слишком большие файлы отклоняем по размеру из Telegram, не скачивая
+    if document.file_size and document.file_size > settings.upload_max_mb * MB:
+        await message.answer(
+            f"Файл слишком большой ({document.file_size / MB:.1f} МБ). "
+            f"Максимальный размер - {settings.upload_max_mb:g} МБ."
+        )
+        return
+
+    # 1.1. Этот файл уже проверяли (переслан повторно) - отвечаем из кеша, даже не скачивая
+    cached = await get_cached_by_file_id(document.file_unique_id, TOPIC)
+    if cached is not None:
+        await _send_analysis(message, cached)
+        return
+
+    # 1.2. Скачивание и анализ - через очередь: ограниченный пул воркеров,
+    # лимиты на чат и очерёдность по кругу между чатами
+    scheduler = get_job_scheduler()
+    queued = False
+
+    async def run() -> None:
+        if queued:
+            await _edit_status(status, "Подошла ваша очередь, начинаю проверку...")
+        await _process_document(message, status, document, suffix)
+
+    try:
+        job = await scheduler.submit(message.chat.id, run)
+    except QueueFull as e:
+        if e.per_user:
+            await message.answer(
+                "У вас уже есть файлы в обработке. "
+                "Дождитесь результата и отправьте следующий документ."
+            )
+        else:
+            await message.answer("Бот сейчас перегружен, попробуйте через пару минут.")
+        return
+
+    position = scheduler.position(job)
+    if position > scheduler.workers - scheduler.in_flight:
+        queued = True
+        await _edit_status(
+            status,
+            f"Файл в очереди, позиция: {position}. Начну проверку, как только освободится место.",
+        )
+
+    try:
+        await job.future
+    except Exception as e:
+        # скачивание/разбор/анализ упали - иначе статус так и останется «начинаю проверку»
+        print(f"[ERROR] Проверка документа не удалась: {e!r}")
+        await _edit_status(
+            status,
+            "Не удалось проверить документ из-за внутренней ошибки. "
+            "Попробуйте отправить его ещё раз чуть позже.",
+        )
+
+
+async def _process_document(message: Message, status: Message, document, suffix: str) -> None:
+    bot: Bot = message.bot
+    temp: _TempInput | None = None
+
+    # 1.3. Обычные файлы скачиваем в память и разбираем оттуда же (без диска);
+    # во временный файл - только крупные и файлы неизвестного размера
+    if document.file_size and document.file_size <= settings.upload_in_memory_mb * MB:
+        buffer = io.BytesIO()
+        await bot.download(document, destination=buffer)
+        source: DocumentSource = buffer.getvalue()
+    else:
+        with NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+            temp = _TempInput(Path(tmp.name))
+            await bot.download(document, destination=tmp)
+        source = temp.path
+
+    try:
+        # 2. Запускаем анализ (или берём готовый / уже идущий для такого же содержимого)
+        content_hash = await asyncio.to_thread(content_sha256, source)
+
+        if settings.progressive_delivery:
+            await _analyze_progressively(
+                message, status, source, suffix, content_hash, document.file_unique_id, temp
+            )
+            return
+
+        async def run() -> DocumentAnalysis:
+            return await run_full_analysis(source, topic=TOPIC, suffix=suffix)
+
+        analysis = await analyze_once(
+            content_hash,
+            TOPIC,
+            temp.owned(run) if temp is not None else run,
+            file_unique_id=document.file_unique_id,
+        )
+
+        # 3-4. Формируем текст ответа и отправляем
+        await _send_analysis(message, analysis)
+
+    finally:
+        # 5. Удаляем временный файл, если анализ по нему так и не запустили
+        # (запущенный анализ удаляет его сам, когда закончит)
+        if temp is not None and not temp.handed_over:
+            temp.remove()
+
 
+class _TempInput:
+    """
+    Временный файл с загрузкой. Анализ идёт в общей single-flight задаче,
+    которая может пережить обработчик (его отменили, а другие ожидающие
+    ещё ждут результат), поэтому после запуска анализа файлом владеет
+    задача: она и удаляет его по завершении.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.handed_over = False
+
+    def owned(self, run: Callable[[], Awaitable[DocumentAnalysis]]) -> Callable[[], Awaitable[DocumentAnalysis]]:
+        def start() -> Awaitable[DocumentAnalysis]:
+            # флаг ставится синхронно, в момент создания задачи в analyze_once
+            self.handed_over = True
+            return self._run_and_remove(run)
+        return start
+
+    async def _run_and_remove(self, run: Callable[[], Awaitable[DocumentAnalysis]]) -> DocumentAnalysis:
+        try:
+            return await run()
+        finally:
+            self.remove()
+
+    def remove(self) -> None:
+        try:
+            self.path.unlink(missing_ok=True)
+        except Exception as e:
+            print(f"[WARN] Не удалось удалить временный файл {self.path}: {e}")
+
+
+async def _edit_status(status: Message, text: str) -> None:
     try:
-        # 2. Запускаем анализ
-        analysis = await run_full_analysis(file_path=tmp_path, topic="госпошлина")
+        await status.edit_text(text)
+    except Exception as e:
+        print(f"[WARN] Не удалось обновить статус: {e}")
+
+
+async def _send_analysis(message: Message, analysis) -> None:
+    # Формируем текст ответа
+    formatted = format_document_analysis(analysis)
+
+    # Режем на части и отправляем
+    for part in split_text_for_telegram(formatted):
+        await message.answer(part)
 
-        # 3. Формируем текст ответа
-        formatted = format_document_analysis(analysis)
 
-        # 4. Режем на части и отправляем
-        for part in split_text_for_telegram(formatted):
-            await message.answer(part)
+async def _analyze_progressively(
+    message: Message,
+    status: Message,
+    source: DocumentSource,
+    suffix: str,
+    content_hash: str,
+    file_unique_id: str,
+    temp: "_TempInput | None" = None,
+) -> None:
+    """
+    Поэтапная выдача: статус-сообщение обновляется по стадиям, каждый
+    фрагмент уходит отдельным сообщением сразу по готовности.
+
+    Анализ по-прежнему идёт через analyze_once (кеш + single-flight):
+    события приходят, только если анализ запустил именно этот запрос.
+    Если результат взят из кеша или из чужого идущего анализа -
+    отправляем его целиком, как в обычном режиме.
+    """
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def run() -> DocumentAnalysis:
+        try:
+            async for event in iter_full_analysis(source, TOPIC, suffix):
+                events.put_nowait(event)
+                if isinstance(event, AnalysisDone):
+                    return event.analysis
+            raise RuntimeError("Анализ завершился без результата")
+        finally:
+            events.put_nowait(None)
 
+    analysis_task = asyncio.create_task(
+        analyze_once(
+            content_hash,
+            TOPIC,
+            temp.owned(run) if temp is not None else run,
+            file_unique_id=file_unique_id,
+        )
+    )
+    progress = _StatusUpdater(status)
+    streamed = False
+
+    try:
+        while True:
+            if events.empty() and analysis_task.done():
+                break
+            getter = asyncio.ensure_future(events.get())
+            await asyncio.wait({getter, analysis_task}, return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                continue
+
+            event = getter.result()
+            if event is None:
+                break
+            streamed = True
+
+            if isinstance(event, AnalysisProgress):
+                await progress.update(_progress_text(event))
+            elif isinstance(event, FragmentReady):
+                for part in split_text_for_telegram(format_fragment_analysis(event.number, event.fragment)):
+                    await message.answer(part)
+
+        analysis = await analysis_task
     finally:
-        # 5. Удаляем временный файл в любом случае
+        if not analysis_task.done():
+            analysis_task.cancel()
+
+    if not streamed:
+        await _send_analysis(message, analysis)
+        return
+
+    risks = sum(1 for f in analysis.fragments if f.label == RiskLabel.risk)
+    failed = sum(1 for f in analysis.fragments if f.label == RiskLabel.failed)
+    summary = f"Проверка завершена. <b>Тема:</b> {analysis.topic}. Рисков: {risks}"
+    if failed:
+        summary += f", не проанализировано из-за ошибок модели: {failed}"
+    await progress.update(summary + ".", force=True)
+
+
+def _progress_text(event: AnalysisProgress) -> str:
+    if event.stage == "extracted":
+        return f"Текст извлечён ({event.chars} символов), фрагментов: {event.fragments_total}. Ищу фрагменты по теме..."
+    if event.stage == "filtered":
+        return (
+            f"Найдено фрагментов по теме: {event.fragments_on_topic} "
+            f"из {event.fragments_total}. Анализирую..."
+        )
+    return f"Проанализировано {event.analyzed} из {event.fragments_on_topic} фрагментов..."
+
+
+class _StatusUpdater:
+    """
+    Правка статус-сообщения не чаще раза в PROGRESS_EDIT_INTERVAL секунд
+    (лимиты Telegram на редактирование); промежуточные статусы можно пропускать.
+    """
+
+    def __init__(self, status: Message) -> None:
+        self.status = status
+        self.last_text = status.text or ""
+        self.last_edit = 0.0
+
+    async def update(self, text: str, force: bool = False) -> None:
+        if text == self.last_text:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_edit < settings.progress_edit_interval:
+            return
         try:
-            tmp_path.unlink(missing_ok=True)
+            await self.status.edit_text(text)
         except Exception as e:
-            print(f"[WARN] Не удалось удалить временный файл {tmp_path}: {e}")
+            print(f"[WARN] Не удалось обновить статус: {e}")
+            return
+        self.last_text = text
+        self.last_edit = now
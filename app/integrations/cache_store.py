@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+
+@dataclass
+class CacheStats:
+    """
+    Статистика обращений к кешу (в рамках текущего процесса).
+    """
+    hits: int = 0
+    misses: int = 0
+    entries: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"hits={self.hits} misses={self.misses} "
+            f"hit_rate={self.hit_rate:.1%} entries={self.entries}"
+        )
+
+
+class SqliteCache:
+    """
+    Персистентный key-value кеш на SQLite:
+    - значения хранятся как BLOB;
+    - вытеснение по LRU при превышении max_entries;
+    - опциональный TTL (секунды, 0 - бессрочно).
+
+    Один файл можно безопасно делить между процессами (бот и индексатор):
+    SQLite сам разруливает блокировки, запись идёт транзакциями.
+    Методы синхронные — из async-кода их вызывают через asyncio.to_thread.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        table: str,
+        max_entries: int,
+        ttl: float = 0.0,
+    ) -> None:
+        self.path = Path(path)
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._stats = CacheStats()
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            str(self.path),
+            timeout=30.0,
+            check_same_thread=False,
+            isolation_level=None,  # транзакции управляем сами
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL"
+            ")"
+        )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_accessed_idx ON {table}(accessed_at)"
+        )
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+
+        now = time.time()
+        found: Dict[str, bytes] = {}
+
+        with self._lock:
+            # SQLite ограничивает число параметров в запросе — идём пачками
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, value, created_at FROM {self.table} "
+                    f"WHERE key IN ({placeholders})",
+                    part,
+                ).fetchall()
+                for key, value, created_at in rows:
+                    if self.ttl and now - created_at > self.ttl:
+                        continue
+                    found[key] = value
+
+            if found:
+                self._conn.executemany(
+                    f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+
+            self._stats.hits += len(found)
+            self._stats.misses += len(keys) - len(found)
+
+        return found
+
+    def set(self, key: str, value: bytes) -> None:
+        self.set_many({key: value})
+
+    def set_many(self, items: Dict[str, bytes]) -> None:
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} "
+                    "(key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    [(key, value, now, now) for key, value in items.items()],
+                )
+                self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                f"DELETE FROM {self.table} WHERE key = ?",
+                [(key,) for key in keys],
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            (entries,) = self._conn.execute(
+                f"SELECT COUNT(*) FROM {self.table}"
+            ).fetchone()
+        return CacheStats(
+            hits=self._stats.hits,
+            misses=self._stats.misses,
+            entries=entries,
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self) -> None:
+        """
+        Удаляет протухшие по TTL записи и самые давно используемые,
+        если записей больше max_entries. Вызывается внутри транзакции.
+        """
+        if self.ttl:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE created_at < ?",
+                (time.time() - self.ttl,),
+            )
+
+        if self.max_entries <= 0:
+            return
+
+        (count,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f" SELECT key FROM {self.table} ORDER BY accessed_at ASC LIMIT ?"
+                ")",
+                (overflow,),
+            )
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import re
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+from app.integrations.cache_store import CacheStats, SqliteCache
+from config import settings
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_CACHE_PATH = BASE_DIR / "data" / "cache" / "embeddings.sqlite3"
+
+_WS_RE = re.compile(r"\s+")
+
+_cache: SqliteCache | None = None
+
+
+def get_embedding_cache() -> SqliteCache | None:
+    """
+    Общий дисковый кеш эмбеддингов (один файл для бота и индексатора).
+    Возвращает None, если кеш выключен в настройках.
+    """
+    global _cache
+    if not settings.embedding_cache_enabled:
+        return None
+    if _cache is None:
+        path = Path(settings.embedding_cache_path or DEFAULT_CACHE_PATH)
+        _cache = SqliteCache(
+            path=path,
+            table="embeddings",
+            max_entries=settings.embedding_cache_max_entries,
+        )
+    return _cache
+
+
+def normalize_text(text: str) -> str:
+    """
+    Нормализация перед хешированием: NFC + схлопывание пробелов.
+    Так одинаковые абзацы с разными переносами строк дают один ключ.
+    """
+    text = unicodedata.normalize("NFC", text)
+    return _WS_RE.sub(" ", text).strip()
+
+
+def make_key(text: str, model: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+def _pack(vector: Sequence[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    vec = array("f")
+    vec.frombytes(blob)
+    return vec.tolist()
+
+
+async def lookup_embeddings(
+    texts: Sequence[str],
+    model: str,
+) -> List[Optional[List[float]]]:
+    """
+    Ищет эмбеддинги в кеше. Для отсутствующих текстов возвращает None
+    (и для всех, если кеш недоступен - заблокирован или повреждён).
+    """
+    cache = get_embedding_cache()
+    if cache is None:
+        return [None] * len(texts)
+
+    keys = [make_key(t, model) for t in texts]
+    try:
+        found = await asyncio.to_thread(cache.get_many, keys)
+    except Exception as e:
+        # как и при записи: поломка кеша - просто промах
+        print(f"[WARN] Не удалось прочитать эмбеддинги из кеша: {e}")
+        return [None] * len(texts)
+    return [_unpack(found[k]) if k in found else None for k in keys]
+
+
+async def store_embeddings(
+    texts: Sequence[str],
+    vectors: Sequence[Sequence[float]],
+    model: str,
+) -> None:
+    cache = get_embedding_cache()
+    if cache is None:
+        return
+
+    items = {make_key(t, model): _pack(v) for t, v in zip(texts, vectors)}
+    try:
+        await asyncio.to_thread(cache.set_many, items)
+    except Exception as e:
+        # кеш - оптимизация, его поломка не должна ронять анализ
+        print(f"[WARN] Не удалось записать эмбеддинги в кеш: {e}")
+
+
+def get_embedding_cache_stats() -> CacheStats | None:
+    cache = get_embedding_cache()
+    return cache.stats() if cache is not None else None
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+INDEX_VERSION = 1
+
+# BM25: насыщение частоты термина и нормировка на длину чанка
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STEM_LEN = 6   # грубый стемминг: слово обрезается до первых 6 букв
+
+# Ссылки на нормы: "ст. 333.36", "пп. 1", "п. 3", "ч. 2", "№ 46" -> "ст333.36", "пп1", "п3", "ч2", "№46"
+_CITATION_RE = re.compile(
+    r"(?<!\w)(подпункт\w*|пункт\w*|стать\w*|част\w*|пп|п|ст|ч|№)\.?\s*(\d+(?:[.\-/]\d+)*)",
+    re.IGNORECASE,
+)
+# числа с точками ("333.36", "25.3") - один токен, слова - отдельно
+_TOKEN_RE = re.compile(r"\d+(?:\.\d+)*|[^\W\d_]+")
+
+_CITATION_PREFIXES = (
+    ("подпункт", "пп"),
+    ("пп", "пп"),
+    ("пункт", "п"),
+    ("п", "п"),
+    ("стать", "ст"),
+    ("ст", "ст"),
+    ("част", "ч"),
+    ("ч", "ч"),
+    ("№", "№"),
+)
+
+
+def _citation_prefix(word: str) -> str:
+    word = word.lower()
+    for prefix, canonical in _CITATION_PREFIXES:
+        if word.startswith(prefix):
+            return canonical
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Токены для лексического поиска:
+      - ссылки на нормы склеиваются в один точный токен ("ст333.36", "№46", "пп1"),
+        чтобы «ст. 333.36» не превращалось в «ст» + «333» + «36»;
+      - номера с точками остаются целыми ("333.36");
+      - слова от 2 букв (чтобы не терять «НК», «РФ», «ВС»), в нижнем регистре
+        и обрезанные до STEM_LEN.
+    """
+    text = text.lower().replace("ё", "е")
+    tokens = [
+        f"{_citation_prefix(m.group(1))}{m.group(2)}"
+        for m in _CITATION_RE.finditer(text)
+    ]
+    for token in _TOKEN_RE.findall(text):
+        if token[0].isdigit():
+            tokens.append(token)
+        elif len(token) >= 2:
+            tokens.append(token[:STEM_LEN])
+    return tokens
+
+
+class LexicalIndex:
+    """
+    Локальный BM25-индекс по тем же чанкам, что и векторное хранилище
+    (id документов = id векторов). Нужен для точных ссылок на нормы
+    («ст. 333.36», «№ 46»), которые плотные эмбеддинги находят плохо.
+
+    На диске - один JSON: частоты терминов, длина и metadata каждого чанка,
+    плюс sha256 проиндексированных файлов (для инкрементальной индексации).
+    Инвертированный индекс строится в памяти при загрузке.
+    """
+
+    def __init__(self) -> None:
+        self.files: Dict[str, str] = {}                 # rel_path -> sha256
+        self.metadata: Dict[str, Dict[str, Any]] = {}
+        self._tf: Dict[str, Dict[str, int]] = {}        # doc_id -> {term: tf}
+        self._lengths: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> {doc_id: tf}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._tf)
+
+    def add(self, doc_id: str, text: str, metadata: Dict[str, Any]) -> None:
+        self._add_tf(doc_id, dict(Counter(tokenize(text))), metadata)
+
+    def _add_tf(self, doc_id: str, tf: Dict[str, int], metadata: Dict[str, Any]) -> None:
+        if doc_id in self._tf:
+            self.remove(doc_id)
+
+        length = sum(tf.values())
+        self._tf[doc_id] = tf
+        self._lengths[doc_id] = length
+        self.metadata[doc_id] = metadata
+        self._total_len += length
+        for term, count in tf.items():
+            self._postings.setdefault(term, {})[doc_id] = count
+
+    def remove(self, doc_id: str) -> None:
+        tf = self._tf.pop(doc_id, None)
+        if tf is None:
+            return
+        self._total_len -= self._lengths.pop(doc_id, 0)
+        self.metadata.pop(doc_id, None)
+        for term in tf:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query: str, k: int = 20) -> List[Tuple[str, float]]:
+        """
+        Top-k чанков по BM25: (id, счёт) по убыванию счёта.
+        """
+        n = len(self._tf)
+        if not n or k <= 0:
+            return []
+
+        avg_len = self._total_len / n or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            for doc_id, tf in postings.items():
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self._lengths[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    @classmethod
+    def load(cls, path: Path) -> "LexicalIndex":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        index = cls()
+        if data.get("version") != INDEX_VERSION:
+            # другой формат/токенизатор - индекс строится заново
+            return index
+        index.files = dict(data.get("files", {}))
+        for doc_id, doc in data.get("docs", {}).items():
+            index._add_tf(doc_id, doc["tf"], doc["metadata"])
+        return index
+
+    def save(self, path: Path) -> None:
+        """
+        Сохраняет индекс (атомарно: через временный файл + os.replace).
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "version": INDEX_VERSION,
+            "files": self.files,
+            "docs": {
+                doc_id: {"tf": tf, "metadata": self.metadata[doc_id]}
+                for doc_id, tf in self._tf.items()
+            },
+        }
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+def get_lexical_index_path() -> Path:
+    # индекс строится по тем же чанкам, что и векторы бэкенда, поэтому у каждого бэкенда свой
+    if settings.lexical_index_path:
+        return Path(settings.lexical_index_path)
+    backend = settings.vector_store_backend.lower().strip()
+    return BASE_DIR / "data" / f"lexical_index.{backend}.json"
+
+
+_index: Optional[LexicalIndex] = None
+_loaded = False
+
+
+def get_lexical_index() -> Optional[LexicalIndex]:
+    """
+    BM25-индекс для гибридного поиска (загружается один раз).
+    None - гибридный поиск выключен или индекс ещё не построен.
+    """
+    global _index, _loaded
+    if not settings.hybrid_search_enabled:
+        return None
+    if not _loaded:
+        _loaded = True
+        path = get_lexical_index_path()
+        try:
+            index = LexicalIndex.load(path)
+        except FileNotFoundError:
+            print(f"[INFO] Лексический индекс не найден ({path}), поиск только по векторам")
+            return None
+        except Exception as e:
+            print(f"[WARN] Не удалось загрузить лексический индекс: {e}")
+            return None
+        print(f"[INFO] Лексический индекс: {len(index)} чанков")
+        _index = index if len(index) else None
+    return _index
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.integrations.vector_store import BaseVectorStore, NormItem, norm_from_metadata
+
+VECTORS_FILE = "vectors.f32"
+META_FILE = "meta.json"
+
+
+def _previous_dim(directory: Path) -> int:
+    try:
+        return int(json.loads((directory / META_FILE).read_text(encoding="utf-8"))["dim"])
+    except Exception:
+        return 0
+
+
+class NumpyVectorStore(BaseVectorStore):
+    """
+    Локальное векторное хранилище в памяти процесса.
+
+    На диске это два файла в одной папке:
+      - vectors.f32 - непрерывная матрица float32 (N x dim), строки уже
+        нормированы, поэтому косинусная близость = скалярное произведение;
+      - meta.json   - размерность, id векторов и их metadata (в том же порядке).
+
+    Матрица открывается через memmap один раз при старте,
+    поиск top-k - один матричный умножитель + argpartition.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = Path(directory)
+
+        meta = json.loads((self.directory / META_FILE).read_text(encoding="utf-8"))
+        self.dim: int = int(meta["dim"])
+        self.ids: List[str] = list(meta["ids"])
+        self.metadata: List[Dict[str, Any]] = list(meta["metadata"])
+
+        count = len(self.ids)
+        if count:
+            self.matrix = np.memmap(
+                self.directory / VECTORS_FILE,
+                dtype=np.float32,
+                mode="r",
+                shape=(count, self.dim),
+            )
+        else:
+            self.matrix = np.zeros((0, self.dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def save(
+        directory: Path,
+        ids: Sequence[str],
+        vectors: Sequence[Sequence[float]],
+        metadata: Sequence[Dict[str, Any]],
+    ) -> None:
+        """
+        Сохраняет хранилище на диск (атомарно: через временные файлы + os.replace).
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        if not len(ids):
+            # все файлы базы удалены: пустое хранилище, размерность - от прежнего (если был)
+            matrix = np.zeros((0, _previous_dim(directory)), dtype=np.float32)
+        else:
+            matrix = np.asarray(vectors, dtype=np.float32)
+            if matrix.ndim != 2:
+                matrix = matrix.reshape(len(ids), -1)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+        meta = {
+            "dim": int(matrix.shape[1]),
+            "ids": list(ids),
+            "metadata": list(metadata),
+        }
+
+        tmp_vectors = directory / (VECTORS_FILE + ".tmp")
+        tmp_meta = directory / (META_FILE + ".tmp")
+        matrix.tofile(tmp_vectors)
+        tmp_meta.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_vectors, directory / VECTORS_FILE)
+        os.replace(tmp_meta, directory / META_FILE)
+
+    @classmethod
+    def load_records(cls, directory: Path) -> Dict[str, Tuple[np.ndarray, Dict[str, Any]]]:
+        """
+        Читает сохранённое хранилище как {id: (вектор, metadata)}.
+        Нужен индексатору для инкрементального обновления. Пустой dict, если хранилища нет.
+        """
+        directory = Path(directory)
+        if not (directory / META_FILE).exists():
+            return {}
+        store = cls(directory)
+        return {
+            vector_id: (np.array(store.matrix[i]), store.metadata[i])
+            for i, vector_id in enumerate(store.ids)
+        }
+
+    def top_k(self, query_embedding: Sequence[float], k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Возвращает [(номер строки, косинусная близость)] по убыванию близости.
+        """
+        if not len(self.ids) or k <= 0:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        q_norm = float(np.linalg.norm(query))
+        if q_norm == 0.0:
+            return []
+        query = query / q_norm
+
+        scores = self.matrix @ query
+        k = min(k, scores.shape[0])
+
+        # argpartition: O(N) отбор k лучших, сортируем только их
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    async def search(
+        self,
+        query_embedding: Sequence[float],
+        k: int = 5,
+    ) -> List[NormItem]:
+        # поиск по памяти занимает доли миллисекунды - в поток не выносим
+        return [
+            norm_from_metadata(self.metadata[i], self.ids[i])
+            for i, _ in self.top_k(query_embedding, k)
+        ]
+
+    async def search_many(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        k: int = 5,
+    ) -> List[List[NormItem]]:
+        """
+        Все запросы документа одним матричным умножением (Q x N).
+        """
+        if not query_embeddings:
+            return []
+        if not len(self.ids) or k <= 0:
+            return [[] for _ in query_embeddings]
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        q_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        q_norms[q_norms == 0] = 1.0
+        scores = (queries / q_norms) @ self.matrix.T
+
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        results: List[List[NormItem]] = []
+        for row, cand in zip(scores, top):
+            cand = cand[np.argsort(-row[cand])]
+            results.append([norm_from_metadata(self.metadata[i], self.ids[i]) for i in cand])
+        return results
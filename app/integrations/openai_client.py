@@ -1,30 +1,255 @@
 from __future__ import annotations
 
-from typing import List, Dict, Any
-import json
+import asyncio
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 import re
 
-from openai import OpenAI
+import httpx
+from openai import APIError, AsyncOpenAI, DefaultAsyncHttpxClient
+from pydantic import BaseModel, ValidationError
 from config import settings
+from app.integrations.embedding_cache import lookup_embeddings, store_embeddings
+from app.integrations.verdict_cache import (
+    get_cached_verdict,
+    make_verdict_key,
+    norm_identity,
+    store_verdict,
+)
+from app.models.analysis import LLMBatchResponse, LLMVerdict, RiskLabel
 
+# Версия шаблона промпта анализа. Меняйте при любой правке system/user prompt,
+# чтобы не получать из кеша вердикты, посчитанные по старому промпту.
+PROMPT_VERSION = "fragment-v2"
+# То же для пакетного промпта (несколько фрагментов в одном запросе)
+BATCH_PROMPT_VERSION = "fragment-batch-v2"
 
-_client: OpenAI | None = None
 
+_client: AsyncOpenAI | None = None
 
-def get_client() -> OpenAI:
+
+def get_client() -> AsyncOpenAI:
+    """
+    Общий асинхронный клиент OpenAI.
+    Все запросы идут через один пул HTTP-соединений (keep-alive),
+    размер пула и таймауты настраиваются через Settings.
+    """
     global _client
     if _client is None:
-        _client = OpenAI(api_key=settings.openai_api_key)
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_keepalive,
+            ),
+            timeout=httpx.Timeout(
+                settings.openai_chat_timeout,
+                connect=settings.openai_connect_timeout,
+            ),
+        )
+        _client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            http_client=http_client,
+            max_retries=settings.openai_max_retries,
+        )
     return _client
 
 
+async def close_client() -> None:
+    """
+    Закрывает пул соединений (вызывается при остановке бота).
+    """
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
 async def get_embedding(text: str, model: str = "text-embedding-3-small") -> List[float]:
+    # идёт через get_embeddings, чтобы попадать в дисковый кеш
+    vectors = await get_embeddings([text], model=model)
+    return vectors[0]
+
+
+def _estimate_tokens(text: str) -> int:
+    """
+    Грубая верхняя оценка числа токенов без tiktoken.
+    Для русского текста у cl100k выходит ~2.5-3 символа на токен,
+    поэтому len/2 заведомо с запасом.
+    """
+    return len(text) // 2 + 1
+
+
+def _pack_batches(
+    texts: Sequence[str],
+    max_items: int,
+    max_tokens: int,
+) -> List[List[int]]:
+    """
+    Раскладывает индексы текстов по батчам так, чтобы в каждом было
+    не больше max_items строк и не больше max_tokens (по оценке) токенов.
+    Слишком длинный текст уходит отдельным батчем.
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+
+    for i, text in enumerate(texts):
+        tokens = _estimate_tokens(text)
+        if current and (
+            len(current) >= max_items or current_tokens + tokens > max_tokens
+        ):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+
+async def get_embeddings(
+    texts: Sequence[str],
+    model: str = "text-embedding-3-small",
+) -> List[List[float]]:
+    """
+    Батчевые эмбеддинги: пакует много строк в один запрос
+    (с учётом лимитов на число строк и токенов) и возвращает
+    векторы в том же порядке, что и входные тексты.
+    Уже посчитанные эмбеддинги берутся из дискового кеша.
+    """
+    if not texts:
+        return []
+
+    result: List[List[float] | None] = await lookup_embeddings(texts, model)
+
+    # в API уходят только промахи кеша, одинаковые тексты - один раз
+    missing: Dict[str, List[int]] = {}
+    for i, vec in enumerate(result):
+        if vec is None:
+            missing.setdefault(texts[i], []).append(i)
+
+    if not missing:
+        return result  # type: ignore[return-value]
+
     client = get_client()
-    resp = client.embeddings.create(
-        model=model,
-        input=text,
+    missing_texts = list(missing)
+
+    batches = _pack_batches(
+        missing_texts,
+        max_items=settings.openai_embedding_batch_size,
+        max_tokens=settings.openai_embedding_batch_tokens,
     )
-    return resp.data[0].embedding
+
+    for batch in batches:
+        batch_texts = [missing_texts[i] for i in batch]
+        resp = await client.embeddings.create(
+            model=model,
+            input=batch_texts,
+            timeout=settings.openai_embedding_timeout,
+        )
+        # порядок в ответе не гарантирован — раскладываем по полю index
+        vectors: List[List[float]] = [None] * len(batch_texts)  # type: ignore[list-item]
+        for item in resp.data:
+            vectors[item.index] = item.embedding
+
+        for text, vec in zip(batch_texts, vectors):
+            for i in missing[text]:
+                result[i] = vec
+
+        await store_embeddings(batch_texts, vectors, model)
+
+    return result  # type: ignore[return-value]
+
+
+# ========================================================================
+#   ОБЩИЕ ЧАСТИ ПРОМПТА АНАЛИЗА
+# ========================================================================
+_ANALYSIS_RULES = (
+    "Ты - юридический анализатор в режиме RAG. "
+    "Ты можешь использовать только те нормы, которые перечислены пользователем. "
+    "Запрещено придумывать статьи, пункты, номера Пленума или обзоры. "
+    "Анализируй по алгоритму:\n"
+    "1) Определи ошибочный тезис (цитата или краткое резюме).\n"
+    "2) Сопоставь с доступными нормами: ищи противоречия, ошибки толкования, неполноту.\n"
+    "3) Квалифицируй ошибку как: «Прямое противоречие НК РФ», «Несоответствие практике ВС РФ», "
+    "«Неполное толкование нормы», «Вводящее в заблуждение разъяснение».\n"
+    "4) Если противоречия нет — вывод «OK». Если есть — «Риск».\n"
+)
+
+
+def _format_norm(i: int, n: Dict[str, Any]) -> str:
+    return f"[{i}] {n.get('type')} {n.get('number')}: {n.get('short_title')} — {n.get('summary')}"
+
+
+@dataclass
+class VerdictStats:
+    requests: int = 0      # запросов к модели за вердиктами
+    invalid: int = 0       # ответов, не прошедших валидацию схемы
+    failed: int = 0        # фрагментов, оставшихся без вердикта после повтора
+    api_errors: int = 0    # запросов, упавших с ошибкой API (таймаут, лимиты, 5xx) после ретраев клиента
+
+    @property
+    def failure_rate(self) -> float:
+        return self.invalid / self.requests if self.requests else 0.0
+
+
+_verdict_stats = VerdictStats()
+
+
+def get_verdict_stats() -> VerdictStats:
+    """
+    Счётчики ответов модели за время жизни процесса (для логов/мониторинга).
+    """
+    return _verdict_stats
+
+
+def _response_format(schema_model: type[BaseModel], name: str) -> Dict[str, Any] | None:
+    """
+    JSON-схема ответа для structured output (strict: модель не может
+    вернуть лишние поля, пропустить обязательные или другой label).
+    None - режим выключен в настройках, формат держится только промптом.
+    """
+    if not settings.openai_structured_output:
+        return None
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": True,
+            "schema": schema_model.model_json_schema(),
+        },
+    }
+
+
+def _validate_response(raw_content: str, schema_model: type[BaseModel]) -> BaseModel | None:
+    """
+    Валидация ответа модели pydantic-схемой. Без structured output модель
+    может окружить JSON текстом - тогда сначала вырезаем JSON-объект.
+    """
+    if not settings.openai_structured_output:
+        match = re.search(r"\{[\s\S]*\}", raw_content)
+        if match:
+            raw_content = match.group(0)
+    try:
+        return schema_model.model_validate_json(raw_content)
+    except ValidationError:
+        return None
+
+
+def _failed_verdict(reason: str) -> Dict[str, Any]:
+    """
+    Явная пометка «анализ не удался» вместо фальшивого «OK».
+    Такие вердикты не кешируются.
+    """
+    return {
+        "label": RiskLabel.failed.value,
+        "comment": reason,
+        "correct_position": "",
+        "source_indices": [],
+    }
 
 
 # ========================================================================
@@ -36,16 +261,17 @@ async def analyze_fragment_with_norms(
     model: str = "gpt-5.1",
 ) -> Dict[str, Any]:
 
+    cache_key = make_verdict_key(fragment_text, norms, model, PROMPT_VERSION)
+    cached = await get_cached_verdict(cache_key)
+    if cached is not None:
+        return cached
+
     client = get_client()
 
     # ==========================
     # Формируем текст норм
     # ==========================
-    norms_lines = []
-    for i, n in enumerate(norms):
-        norms_lines.append(
-            f"[{i}] {n.get('type')} {n.get('number')}: {n.get('short_title')} — {n.get('summary')}"
-        )
+    norms_lines = [_format_norm(i, n) for i, n in enumerate(norms)]
     norms_text = "\n".join(norms_lines) if norms_lines else "нет доступных норм"
 
 
@@ -53,16 +279,8 @@ async def analyze_fragment_with_norms(
     # Новый короткий SYSTEM PROMPT
     # ==========================
     system_msg = (
-        "Ты - юридический анализатор в режиме RAG. "
-        "Ты можешь использовать только те нормы, которые перечислены пользователем. "
-        "Запрещено придумывать статьи, пункты, номера Пленума или обзоры. "
-        "Анализируй по алгоритму:\n"
-        "1) Определи ошибочный тезис (цитата или краткое резюме).\n"
-        "2) Сопоставь с доступными нормами: ищи противоречия, ошибки толкования, неполноту.\n"
-        "3) Квалифицируй ошибку как: «Прямое противоречие НК РФ», «Несоответствие практике ВС РФ», "
-        "«Неполное толкование нормы», «Вводящее в заблуждение разъяснение».\n"
-        "4) Если противоречия нет — вывод «OK». Если есть — «Риск».\n"
-        "5) Ты обязан выводить ответ строго в JSON:\n"
+        _ANALYSIS_RULES
+        + "5) Ты обязан выводить ответ строго в JSON:\n"
         "{\n"
         "  \"label\": \"OK\" | \"Риск\",\n"
         "  \"comment\": \"1-3 предложения\",\n"
@@ -89,55 +307,273 @@ async def analyze_fragment_with_norms(
 
 
     # ==========================
-    # Вызов OpenAI
+    # Вызов OpenAI (с одним повтором, если ответ не прошёл схему)
     # ==========================
-    resp = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": system_msg},
-            {"role": "user", "content": user_msg},
-        ],
-        temperature=0.0,
-        max_tokens=400,
+    response_format = _response_format(LLMVerdict, "fragment_verdict")
+    extra = {"response_format": response_format} if response_format else {}
+
+    for attempt in range(2):
+        try:
+            resp = await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_msg},
+                    {"role": "user", "content": user_msg},
+                ],
+                temperature=0.0,
+                max_tokens=400,
+                timeout=settings.openai_chat_timeout,
+                **extra,
+            )
+        except APIError as e:
+            # клиент уже сделал свои повторы (OPENAI_MAX_RETRIES): ошибка одного
+            # фрагмента не должна ронять весь документ, как и в пакетном режиме
+            print(f"[WARN] Запрос анализа фрагмента не удался: {e}")
+            _verdict_stats.api_errors += 1
+            _verdict_stats.failed += 1
+            return _failed_verdict(
+                "Сервис анализа не ответил, фрагмент не проанализирован. "
+                "Проверьте его вручную или отправьте документ повторно."
+            )
+        _verdict_stats.requests += 1
+
+        verdict = _validate_response(resp.choices[0].message.content or "", LLMVerdict)
+        if verdict is not None:
+            data = verdict.model_dump()
+            # кешируем только успешно разобранные ответы
+            await store_verdict(cache_key, data)
+            return data
+
+        _verdict_stats.invalid += 1
+        print(f"[WARN] Ответ модели не прошёл схему вердикта (попытка {attempt + 1})")
+
+    _verdict_stats.failed += 1
+    return _failed_verdict(
+        "Модель не вернула корректный ответ, фрагмент не проанализирован. "
+        "Проверьте его вручную или отправьте документ повторно."
     )
 
-    raw_content = resp.choices[0].message.content or "{}"
 
-    # ==========================
-    # Надёжный JSON-парсер
-    # ==========================
+# ========================================================================
+#   ПАКЕТНЫЙ АНАЛИЗ: НЕСКОЛЬКО ФРАГМЕНТОВ С ОБЩИМ СПИСКОМ НОРМ
+# ========================================================================
+# Фрагмент для пакетного анализа: текст + его собственный список норм
+FragmentWithNorms = Tuple[str, List[Dict[str, Any]]]
 
-    # 1) Пытаемся вытащить JSON блок даже если модель окружила его текстом
-    match = re.search(r"\{[\s\S]*\}", raw_content)
-    if match:
-        raw_content = match.group(0)
 
-    try:
-        data = json.loads(raw_content)
+def pack_fragment_batches(
+    items: Sequence[FragmentWithNorms],
+    max_items: int,
+    max_tokens: int,
+) -> List[List[int]]:
+    """
+    Раскладывает фрагменты по пакетам для analyze_fragments_with_norms.
+    Нормы внутри пакета общие (без повторов), поэтому в бюджет max_tokens
+    считается только текст фрагмента и нормы, которых в пакете ещё нет.
+    Фрагмент, не влезающий в бюджет даже один, уходит отдельным пакетом.
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    current_norms: set[str] = set()
 
-        if not isinstance(data, dict):
-            raise ValueError("Not a dict")
+    for i, (fragment_text, norms) in enumerate(items):
+        new_norms = {norm_identity(n): n for n in norms if norm_identity(n) not in current_norms}
+        tokens = _estimate_tokens(fragment_text) + sum(
+            _estimate_tokens(_format_norm(0, n)) for n in new_norms.values()
+        )
+        if current and (
+            len(current) >= max_items or current_tokens + tokens > max_tokens
+        ):
+            batches.append(current)
+            current, current_tokens, current_norms = [], 0, set()
+            tokens = _estimate_tokens(fragment_text) + sum(
+                _estimate_tokens(_format_norm(0, n)) for n in norms
+            )
+        current.append(i)
+        current_tokens += tokens
+        current_norms.update(norm_identity(n) for n in norms)
 
-        # Валидация
-        if data.get("label") not in ("OK", "Риск"):
-            data["label"] = "OK"
+    if current:
+        batches.append(current)
 
-        data.setdefault("comment", "")
-        data.setdefault("correct_position", "")
+    return batches
 
-        if not isinstance(data.get("source_indices"), list):
-            data["source_indices"] = []
 
-        return data
+def _parse_batch_response(raw_content: str, count: int) -> Dict[int, Dict[str, Any]]:
+    """
+    Разбирает ответ пакета (схема LLMBatchResponse). Возвращает вердикты
+    по номеру фрагмента; пропущенные фрагменты уйдут на одиночный анализ.
+    """
+    response = _validate_response(raw_content, LLMBatchResponse)
+    if response is None:
+        _verdict_stats.invalid += 1
+        return {}
 
-    except Exception:
-        # fallback — но теперь ЧЕСТНЫЙ
-        return {
-            "label": "OK",
-            "comment": (
-                "Модель вернула некорректный JSON. "
-                "Источников недостаточно или формат нарушен."
-            ),
-            "correct_position": "",
-            "source_indices": [],
-        }
+    verdicts: Dict[int, Dict[str, Any]] = {}
+    for item in response.verdicts:  # type: ignore[attr-defined]
+        if 0 <= item.fragment < count:
+            verdicts[item.fragment] = item.model_dump(exclude={"fragment"})
+    return verdicts
+
+
+async def analyze_fragments_with_norms(
+    items: Sequence[FragmentWithNorms],
+    model: str = "gpt-5.1",
+) -> List[Dict[str, Any]]:
+    """
+    Пакетный анализ: несколько фрагментов и общий (дедуплицированный) список
+    норм в одном запросе, ответ - массив вердиктов по фрагментам.
+
+    Формат каждого вердикта тот же, что у analyze_fragment_with_norms,
+    source_indices - индексы в собственном списке норм фрагмента.
+    Фрагменты, по которым пакетный ответ не разобрался, анализируются
+    по одному через analyze_fragment_with_norms.
+    """
+    if not items:
+        return []
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    keys = [
+        make_verdict_key(fragment_text, norms, model, BATCH_PROMPT_VERSION)
+        for fragment_text, norms in items
+    ]
+
+    cached = await asyncio.gather(*(get_cached_verdict(key) for key in keys))
+    pending: List[int] = []
+    for i, verdict in enumerate(cached):
+        if verdict is not None:
+            results[i] = verdict
+        else:
+            pending.append(i)
+
+    if len(pending) == 1:
+        i = pending[0]
+        results[i] = await analyze_fragment_with_norms(items[i][0], items[i][1], model=model)
+        return results  # type: ignore[return-value]
+
+    if pending:
+        # общий список норм: каждая норма один раз, у фрагмента - её индексы в нём
+        shared: List[Dict[str, Any]] = []
+        shared_index: Dict[str, int] = {}
+        local_to_shared: List[List[int]] = []
+        for i in pending:
+            mapping = []
+            for n in items[i][1]:
+                ident = norm_identity(n)
+                if ident not in shared_index:
+                    shared_index[ident] = len(shared)
+                    shared.append(n)
+                mapping.append(shared_index[ident])
+            local_to_shared.append(mapping)
+
+        verdicts = await _request_batch(
+            [items[i][0] for i in pending],
+            shared,
+            local_to_shared,
+            model=model,
+        )
+
+        fallback: List[int] = []
+        for pos, i in enumerate(pending):
+            verdict = verdicts.get(pos)
+            if verdict is None:
+                fallback.append(i)
+                continue
+
+            # индексы общего списка -> индексы в собственных нормах фрагмента
+            shared_to_local = {s: local for local, s in enumerate(local_to_shared[pos])}
+            local_indices = []
+            for s in verdict["source_indices"]:
+                local = shared_to_local.get(s)
+                if local is not None and local not in local_indices:
+                    local_indices.append(local)
+            verdict["source_indices"] = local_indices
+
+            results[i] = verdict
+            await store_verdict(keys[i], verdict)
+
+        if fallback:
+            print(f"[WARN] Пакетный ответ не разобран для {len(fallback)} фрагм., анализ по одному")
+            # последовательно: пакет занимает один слот ANALYSIS_CONCURRENCY у анализатора,
+            # параллельные одиночные запросы умножили бы реальную параллельность на размер пакета
+            for i in fallback:
+                results[i] = await analyze_fragment_with_norms(items[i][0], items[i][1], model=model)
+
+    return results  # type: ignore[return-value]
+
+
+async def _request_batch(
+    fragments: List[str],
+    shared_norms: List[Dict[str, Any]],
+    local_to_shared: List[List[int]],
+    model: str,
+) -> Dict[int, Dict[str, Any]]:
+    client = get_client()
+
+    norms_lines = [_format_norm(i, n) for i, n in enumerate(shared_norms)]
+    norms_text = "\n".join(norms_lines) if norms_lines else "нет доступных норм"
+
+    fragments_lines = []
+    for j, (fragment_text, mapping) in enumerate(zip(fragments, local_to_shared)):
+        allowed = ", ".join(str(s) for s in mapping) if mapping else "нет"
+        fragments_lines.append(
+            f"Фрагмент #{j} (нормы: {allowed})\n"
+            "-----------------\n"
+            f"{fragment_text}\n"
+            "-----------------"
+        )
+    fragments_text = "\n\n".join(fragments_lines)
+
+    system_msg = (
+        _ANALYSIS_RULES
+        + "5) Пользователь присылает несколько фрагментов. Каждый фрагмент анализируй "
+        "независимо и только по нормам, указанным для него.\n"
+        "6) Ты обязан выводить ответ строго в JSON, по одному объекту на фрагмент:\n"
+        "{\n"
+        "  \"verdicts\": [\n"
+        "    {\n"
+        "      \"fragment\": номер фрагмента,\n"
+        "      \"label\": \"OK\" | \"Риск\",\n"
+        "      \"comment\": \"1-3 предложения\",\n"
+        "      \"correct_position\": \"правильная позиция по нормам\",\n"
+        "      \"source_indices\": [индексы норм]\n"
+        "    }\n"
+        "  ]\n"
+        "}\n"
+        "Никакого текста вне JSON."
+    )
+
+    user_msg = (
+        "Проанализируй каждый юридический фрагмент по алгоритму из system prompt.\n\n"
+        "Доступные нормы:\n"
+        f"{norms_text}\n\n"
+        "Фрагменты:\n\n"
+        f"{fragments_text}\n\n"
+        "Используй только эти нормы. "
+        "Ответ строго в JSON без текста вне JSON."
+    )
+
+    response_format = _response_format(LLMBatchResponse, "fragment_verdicts")
+    extra = {"response_format": response_format} if response_format else {}
+
+    try:
+        resp = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_msg},
+                {"role": "user", "content": user_msg},
+            ],
+            temperature=0.0,
+            max_tokens=400 * len(fragments),
+            timeout=settings.openai_chat_timeout,
+            **extra,
+        )
+    except Exception as e:
+        print(f"[WARN] Пакетный запрос анализа не удался: {e}")
+        if isinstance(e, APIError):
+            _verdict_stats.api_errors += 1
+        return {}
+    _verdict_stats.requests += 1
+
+    return _parse_batch_response(resp.choices[0].message.content or "", len(fragments))
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-from typing import Any
+import asyncio
+from typing import Any, List, Sequence
 
 from pinecone import Pinecone, ServerlessSpec
 
 from config import settings
+from app.integrations.vector_store import BaseVectorStore, NormItem, norm_from_metadata
 
 _pc: Pinecone | None = None
 _index: Any | None = None
@@ -48,3 +50,56 @@ def get_pinecone_index():
 
     _index = pc.Index(index_name)
     return _index
+
+
+class PineconeVectorStore(BaseVectorStore):
+    """
+    Реализация BaseVectorStore поверх индекса Pinecone.
+
+    SDK Pinecone синхронный, поэтому запросы уходят в пул потоков
+    (asyncio.to_thread), а параллельность ограничена семафором.
+    Индекс резолвится в конструкторе, т.е. при старте бота,
+    а не в первом пользовательском запросе.
+    """
+
+    def __init__(self, max_concurrency: int | None = None) -> None:
+        self.index = get_pinecone_index()
+        self._semaphore = asyncio.Semaphore(
+            max_concurrency or settings.pinecone_query_concurrency
+        )
+
+    def _query(self, query_embedding: Sequence[float], k: int) -> List[NormItem]:
+        res = self.index.query(
+            vector=list(query_embedding),
+            top_k=k,
+            include_metadata=True,
+        )
+
+        # в новом SDK res может быть dict или объект – обрабатываем оба варианта
+        matches = res["matches"] if isinstance(res, dict) else res.matches
+
+        norms: List[NormItem] = []
+        for m in matches or []:
+            md = m["metadata"] if isinstance(m, dict) else getattr(m, "metadata", {}) or {}
+            match_id = m.get("id") if isinstance(m, dict) else getattr(m, "id", None)
+            norms.append(norm_from_metadata(md, match_id))
+
+        return norms
+
+    async def search(
+        self,
+        query_embedding: Sequence[float],
+        k: int = 5,
+    ) -> List[NormItem]:
+        async with self._semaphore:
+            return await asyncio.to_thread(self._query, query_embedding, k)
+
+    async def search_many(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        k: int = 5,
+    ) -> List[List[NormItem]]:
+        # все запросы документа летят одновременно (в пределах семафора)
+        return list(
+            await asyncio.gather(*(self.search(q, k=k) for q in query_embeddings))
+        )
@@ -1,7 +1,13 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import List, Protocol, Sequence
+from pathlib import Path
+from typing import Any, Dict, List, Protocol, Sequence
+
+from config import settings
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_LOCAL_STORE_DIR = BASE_DIR / "data" / "vector_store"
 
 
 @dataclass
@@ -15,6 +21,27 @@ class NormItem:
     short_title: str   # краткое текстовое описание
     url: str | None    # ссылка (если есть)
     summary: str       # 2-3 предложения по сути нормы
+    id: str | None = None  # id вектора в хранилище (для кешей и дедупликации)
+
+
+def norm_from_metadata(md: Dict[str, Any], vector_id: str | None = None) -> NormItem:
+    """
+    Собирает NormItem из metadata вектора.
+    Ожидается, что в metadata хранятся:
+      - type
+      - number
+      - short_title
+      - url
+      - summary
+    """
+    return NormItem(
+        type=str(md.get("type", "")),
+        number=str(md.get("number", "")),
+        short_title=str(md.get("short_title", "")),
+        url=md.get("url"),
+        summary=str(md.get("summary", "")),
+        id=vector_id,
+    )
 
 
 class BaseVectorStore(Protocol):
@@ -29,6 +56,18 @@ class BaseVectorStore(Protocol):
     ) -> List[NormItem]:
         ...
 
+    async def search_many(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        k: int = 5,
+    ) -> List[List[NormItem]]:
+        """
+        Поиск сразу по нескольким запросам (все фрагменты документа).
+        Реализация по умолчанию - последовательные вызовы search;
+        хранилища переопределяют её, если умеют быстрее.
+        """
+        return [await self.search(q, k=k) for q in query_embeddings]
+
 
 class DummyVectorStore(BaseVectorStore):
     """
@@ -65,3 +104,42 @@ class DummyVectorStore(BaseVectorStore):
             ),
         ]
         return items[:k]
+
+
+_store: BaseVectorStore | None = None
+
+
+def get_local_store_dir() -> Path:
+    return Path(settings.local_vector_store_dir or DEFAULT_LOCAL_STORE_DIR)
+
+
+def get_vector_store() -> BaseVectorStore:
+    """
+    Возвращает векторное хранилище, выбранное в настройках (VECTOR_STORE_BACKEND):
+      - "pinecone" - облачный индекс Pinecone (по умолчанию);
+      - "local"    - NumpyVectorStore из data/vector_store (грузится один раз);
+      - "dummy"    - заглушка с фиксированными нормами.
+    """
+    global _store
+    if _store is not None:
+        return _store
+
+    backend = settings.vector_store_backend.lower().strip()
+
+    if backend == "local":
+        # numpy нужен только для локального бэкенда
+        from app.integrations.local_vector_store import NumpyVectorStore
+
+        store = NumpyVectorStore(get_local_store_dir())
+        print(f"[INFO] Локальное векторное хранилище: {len(store)} векторов")
+        _store = store
+    elif backend == "dummy":
+        _store = DummyVectorStore()
+    elif backend == "pinecone":
+        from app.integrations.pinecone_client import PineconeVectorStore
+
+        _store = PineconeVectorStore()
+    else:
+        raise RuntimeError(f"Неизвестный VECTOR_STORE_BACKEND: {settings.vector_store_backend}")
+
+    return _store
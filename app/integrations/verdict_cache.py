@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.integrations.cache_store import CacheStats, SqliteCache
+from app.integrations.embedding_cache import normalize_text
+from config import settings
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_CACHE_PATH = BASE_DIR / "data" / "cache" / "verdicts.sqlite3"
+
+_cache: SqliteCache | None = None
+
+
+def get_verdict_cache() -> SqliteCache | None:
+    """
+    Кеш LLM-вердиктов. При temperature=0 ответ на тот же фрагмент с теми же
+    нормами и тем же промптом детерминирован, поэтому его можно переиспользовать.
+    Возвращает None, если кеш выключен в настройках.
+    """
+    global _cache
+    if not settings.verdict_cache_enabled:
+        return None
+    if _cache is None:
+        path = Path(settings.verdict_cache_path or DEFAULT_CACHE_PATH)
+        _cache = SqliteCache(
+            path=path,
+            table="verdicts",
+            max_entries=settings.verdict_cache_max_entries,
+            ttl=settings.verdict_cache_ttl,
+        )
+    return _cache
+
+
+def norm_identity(norm: Dict[str, Any]) -> str:
+    """
+    Идентичность нормы: id вектора, если он есть, иначе хеш её содержимого.
+    """
+    if norm.get("id"):
+        return str(norm["id"])
+    payload = "\x1f".join(
+        str(norm.get(field, ""))
+        for field in ("type", "number", "short_title", "summary")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def make_verdict_key(
+    fragment_text: str,
+    norms: Sequence[Dict[str, Any]],
+    model: str,
+    prompt_version: str,
+) -> str:
+    fragment_hash = hashlib.sha256(normalize_text(fragment_text).encode("utf-8")).hexdigest()
+    norm_ids: List[str] = [norm_identity(n) for n in norms]  # порядок важен: индексы источников
+    payload = json.dumps(
+        [model, prompt_version, fragment_hash, norm_ids],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def get_cached_verdict(key: str) -> Optional[Dict[str, Any]]:
+    cache = get_verdict_cache()
+    if cache is None:
+        return None
+    try:
+        blob = await asyncio.to_thread(cache.get, key)
+    except Exception as e:
+        # недоступный кеш - просто промах, вердикт запросим у модели
+        print(f"[WARN] Не удалось прочитать вердикт из кеша: {e}")
+        return None
+    if blob is None:
+        return None
+    try:
+        return json.loads(blob.decode("utf-8"))
+    except Exception:
+        return None
+
+
+async def store_verdict(key: str, verdict: Dict[str, Any]) -> None:
+    cache = get_verdict_cache()
+    if cache is None:
+        return
+    blob = json.dumps(verdict, ensure_ascii=False).encode("utf-8")
+    try:
+        await asyncio.to_thread(cache.set, key, blob)
+    except Exception as e:
+        print(f"[WARN] Не удалось записать вердикт в кеш: {e}")
+
+
+def invalidate_verdict_cache() -> None:
+    """
+    Полностью сбрасывает кеш вердиктов.
+    Вызывается после переиндексации базы знаний: нормы могли поменяться.
+    """
+    cache = get_verdict_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def get_verdict_cache_stats() -> CacheStats | None:
+    cache = get_verdict_cache()
+    return cache.stats() if cache is not None else None
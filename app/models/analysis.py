@@ -1,10 +1,13 @@
 from enum import Enum
-from pydantic import BaseModel
+from typing import Literal
+
+from pydantic import BaseModel, ConfigDict
 
 
 class RiskLabel(str, Enum):
     ok = "OK"
     risk = "Риск"
+    failed = "Ошибка анализа"   # модель не дала валидный ответ - это НЕ «OK»
 
 
 class SourceRef(BaseModel):
@@ -25,3 +28,28 @@ class FragmentAnalysis(BaseModel):
 class DocumentAnalysis(BaseModel):
     topic: str                 # например, "госпошлина"
     fragments: list[FragmentAnalysis]
+    complete: bool = True      # False - не кешировать: часть фрагментов не проанализирована или текст не извлечён
+
+
+class LLMVerdict(BaseModel):
+    """
+    Ответ LLM по одному фрагменту - JSON-схема для structured output.
+    Все поля обязательные и лишних нет: так требует strict-режим OpenAI.
+    """
+    model_config = ConfigDict(extra="forbid")
+
+    label: Literal["OK", "Риск"]
+    comment: str
+    correct_position: str
+    source_indices: list[int]
+
+
+class LLMBatchVerdict(LLMVerdict):
+    fragment: int              # номер фрагмента в пакете
+
+
+class LLMBatchResponse(BaseModel):
+    # strict-режим требует объект в корне, поэтому массив завёрнут в поле
+    model_config = ConfigDict(extra="forbid")
+
+    verdicts: list[LLMBatchVerdict]
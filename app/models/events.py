@@ -0,0 +1,37 @@
+from dataclasses import dataclass
+from typing import Union
+
+from app.models.analysis import DocumentAnalysis, FragmentAnalysis
+
+
+@dataclass
+class AnalysisProgress:
+    """
+    Прогресс пайплайна анализа:
+      - "extracted" - текст извлечён (chars символов, fragments_total фрагментов);
+      - "filtered"  - по теме найдено fragments_on_topic фрагментов;
+      - "analyzing" - проанализировано analyzed из fragments_on_topic.
+    """
+    stage: str
+    chars: int = 0
+    fragments_total: int = 0
+    fragments_on_topic: int = 0
+    analyzed: int = 0
+
+
+@dataclass
+class FragmentReady:
+    """
+    Готовый вердикт по фрагменту. number - номер фрагмента в итоговом
+    отчёте (порядок в документе), события приходят в порядке готовности.
+    """
+    number: int
+    fragment: FragmentAnalysis
+
+
+@dataclass
+class AnalysisDone:
+    analysis: DocumentAnalysis
+
+
+AnalysisEvent = Union[AnalysisProgress, FragmentReady, AnalysisDone]
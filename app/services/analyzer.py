@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-from pathlib import Path
-from typing import List
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 from app.models.analysis import (
     DocumentAnalysis,
@@ -9,173 +9,426 @@ from app.models.analysis import (
     RiskLabel,
     SourceRef,
 )
-from app.services.text_extractor import extract_text
+from app.models.events import (
+    AnalysisDone,
+    AnalysisEvent,
+    AnalysisProgress,
+    FragmentReady,
+)
+from app.services.extraction_pool import extract_text_async
+from app.services.text_extractor import DocumentSource
 from app.services.splitter import split_into_fragments
 from app.services.topic_filter import filter_fragments_by_topic
-from app.services.rag_search import find_relevant_norms, NormItem
-from app.integrations.openai_client import analyze_fragment_with_norms
+from app.services.topic_semantic import get_topic_prototypes
+from app.services.dedup import cluster_near_duplicates
+from app.services.rag_search import find_relevant_norms_many, NormItem
+from app.integrations.openai_client import (
+    analyze_fragment_with_norms,
+    analyze_fragments_with_norms,
+    get_embeddings,
+    pack_fragment_batches,
+)
+from config import settings
 
 
-async def run_full_analysis(file_path: Path, topic: str) -> DocumentAnalysis:
+async def run_full_analysis(
+    source: DocumentSource,
+    topic: str,
+    suffix: str | None = None,
+) -> DocumentAnalysis:
     """
     Полный пайплайн анализа документа:
 
-      1) Извлечение текста из файла.
+      1) Извлечение текста из файла или из содержимого в памяти (suffix -
+         формат) в пуле процессов, без блокировки бота.
       2) Разбиение текста на фрагменты.
-      3) Фильтрация фрагментов по теме (сейчас: 'госпошлина').
-      4) Для каждого фрагмента по теме:
-         - поиск релевантных норм в Pinecone (RAG),
+      3) Фильтрация фрагментов по теме (сейчас: 'госпошлина'): ключевые слова
+         и, если включён, семантический фильтр по прототипам темы.
+      4) Для каждого фрагмента по теме (параллельно, с лимитами из Settings):
+         - поиск релевантных норм в Pinecone (RAG) + BM25 по точным ссылкам,
          - анализ через LLM (OK / Риск + комментарий + корректная позиция),
          - маппинг выбранных источников по индексам.
+         Почти одинаковые фрагменты анализируются один раз, вердикт
+         копируется на все копии.
 
     Возвращает DocumentAnalysis, который потом форматируется для Telegram.
+    Пошаговая версия с событиями по ходу анализа - iter_full_analysis.
+    """
+    async for event in iter_full_analysis(source, topic, suffix):
+        if isinstance(event, AnalysisDone):
+            return event.analysis
+    raise RuntimeError("Анализ завершился без результата")
+
+
+async def iter_full_analysis(
+    source: DocumentSource,
+    topic: str,
+    suffix: str | None = None,
+) -> AsyncIterator[AnalysisEvent]:
+    """
+    Тот же пайплайн, что и run_full_analysis, но в виде асинхронного итератора:
+    AnalysisProgress по стадиям, FragmentReady по каждому фрагменту сразу
+    по готовности (в порядке завершения), в конце - AnalysisDone с итогом.
     """
     # 1. Извлекаем текст
-    raw_text = extract_text(file_path)
+    raw_text = await extract_text_async(source, suffix)
 
     # 2. Режем на фрагменты
     fragments_text: List[str] = split_into_fragments(raw_text)
+    yield AnalysisProgress(
+        stage="extracted",
+        chars=len(raw_text),
+        fragments_total=len(fragments_text),
+    )
 
     # 3. Фильтруем по теме
     duty_fragments: List[str] = filter_fragments_by_topic(fragments_text, topic=topic)
 
-    fragments_models: List[FragmentAnalysis] = []
+    # 3.1. Семантический фильтр (если включён): эмбеддинги нужны для поиска норм
+    # всё равно, поэтому считаем их сразу для всех фрагментов и переиспользуем
+    duty_embeddings: Optional[List[List[float]]] = None
+    prototypes = get_topic_prototypes()
+    if prototypes is not None and prototypes.has_topic(topic) and fragments_text:
+        all_embeddings = await get_embeddings(fragments_text)
+        keyword_hits = set(duty_fragments)
+        keep = prototypes.filter_indices(
+            topic,
+            all_embeddings,
+            [frag in keyword_hits for frag in fragments_text],
+            threshold=settings.topic_semantic_threshold,
+            threshold_no_keyword=settings.topic_semantic_threshold_no_keyword,
+        )
+        print(
+            f"[INFO] Семантический фильтр: по ключевым словам {len(duty_fragments)}, "
+            f"после фильтра {len(keep)} из {len(fragments_text)}"
+        )
+        duty_fragments = [fragments_text[i] for i in keep]
+        duty_embeddings = [all_embeddings[i] for i in keep]
+
+    yield AnalysisProgress(
+        stage="filtered",
+        fragments_total=len(fragments_text),
+        fragments_on_topic=len(duty_fragments),
+    )
 
     # Случай 1: вообще не смогли вытащить текст
     if not fragments_text:
-        fragments_models.append(
-            FragmentAnalysis(
-                fragment_text="Не удалось извлечь текст из документа.",
-                label=RiskLabel.ok,
-                comment="Проверьте формат файла или попробуйте другой документ.",
-                correct_position="Для анализа нужен текстовый docx/pdf (не скан без OCR).",
-                sources=[
-                    SourceRef(
-                        type="Доктрина",
-                        number="N/A",
-                        short_title="Технический комментарий бота",
-                        url=None,
-                    )
-                ],
-            )
+        note = FragmentAnalysis(
+            fragment_text="Не удалось извлечь текст из документа.",
+            label=RiskLabel.ok,
+            comment="Проверьте формат файла или попробуйте другой документ.",
+            correct_position="Для анализа нужен текстовый docx/pdf (не скан без OCR).",
+            sources=[
+                SourceRef(
+                    type="Доктрина",
+                    number="N/A",
+                    short_title="Технический комментарий бота",
+                    url=None,
+                )
+            ],
         )
-        return DocumentAnalysis(topic=topic, fragments=fragments_models)
+        yield FragmentReady(number=1, fragment=note)
+        # complete=False: пустой текст бывает и из-за таймаута/сбоя пула -
+        # такой результат не кешируем, повторная отправка файла проверит его заново
+        yield AnalysisDone(DocumentAnalysis(topic=topic, fragments=[note], complete=False))
+        return
 
     # Случай 2: текст есть, но по теме ничего нет
     if not duty_fragments:
-        fragments_models.append(
-            FragmentAnalysis(
-                fragment_text=(
-                    "В документе не найдено фрагментов, связанных с темой "
-                    f"«{topic}»."
-                ),
-                label=RiskLabel.ok,
-                comment="Бот не нашёл упоминаний госпошлины и связанных с ней конструкций.",
-                correct_position=(
-                    "Чтобы провести анализ, добавьте в документ блоки про размер, "
-                    "уплату, льготы или распределение государственной пошлины."
-                ),
-                sources=[
-                    SourceRef(
-                        type="Доктрина",
-                        number="N/A",
-                        short_title="Внутренняя логика бота (фильтр по теме)",
-                        url=None,
-                    )
-                ],
-            )
+        note = FragmentAnalysis(
+            fragment_text=(
+                "В документе не найдено фрагментов, связанных с темой "
+                f"«{topic}»."
+            ),
+            label=RiskLabel.ok,
+            comment="Бот не нашёл упоминаний госпошлины и связанных с ней конструкций.",
+            correct_position=(
+                "Чтобы провести анализ, добавьте в документ блоки про размер, "
+                "уплату, льготы или распределение государственной пошлины."
+            ),
+            sources=[
+                SourceRef(
+                    type="Доктрина",
+                    number="N/A",
+                    short_title="Внутренняя логика бота (фильтр по теме)",
+                    url=None,
+                )
+            ],
         )
-        return DocumentAnalysis(topic=topic, fragments=fragments_models)
+        yield FragmentReady(number=1, fragment=note)
+        yield AnalysisDone(DocumentAnalysis(topic=topic, fragments=[note]))
+        return
 
     # Случай 3: есть фрагменты по теме — анализируем каждый
-    for idx, frag_text in enumerate(duty_fragments[:5], start=1):
-        # 4.1. Ищем релевантные нормы в Pinecone
-        norms: List[NormItem] = await find_relevant_norms(frag_text, k=5)
-
-        # Приводим к простому dict-формату для LLM
-        norms_for_llm = [
-            {
-                "type": n.type,
-                "number": n.number,
-                "short_title": n.short_title,
-                "summary": getattr(n, "summary", ""),
-            }
-            for n in norms
-        ]
 
-        # 4.2. LLM-анализ: OK / Риск + комментарий + корректная позиция + индексы источников
-        llm_result = await analyze_fragment_with_norms(
-            fragment_text=frag_text,
-            norms=norms_for_llm,
+    # 3.2. Почти одинаковые фрагменты (один пункт в иске, ходатайстве, приложениях)
+    # анализируем один раз - по представителю кластера
+    if settings.dedup_enabled:
+        clusters = cluster_near_duplicates(duty_fragments, max_distance=settings.dedup_max_distance)
+        if len(clusters) < len(duty_fragments):
+            print(
+                f"[INFO] Почти дубликаты: {len(duty_fragments)} фрагментов -> "
+                f"{len(clusters)} для анализа"
+            )
+    else:
+        clusters = [[i] for i in range(len(duty_fragments))]
+
+    limit = settings.analysis_max_fragments
+    clusters_to_analyze = clusters[:limit] if limit > 0 else clusters
+    to_analyze = [duty_fragments[cluster[0]] for cluster in clusters_to_analyze]
+
+    # 4.0. Эмбеддинги всех фрагментов — одним батчевым запросом (или уже готовые)
+    if duty_embeddings is not None:
+        embeddings = [duty_embeddings[cluster[0]] for cluster in clusters_to_analyze]
+    else:
+        embeddings = await get_embeddings(to_analyze)
+
+    # 4.1. Ищем релевантные нормы сразу для всех фрагментов (параллельно)
+    norms_per_fragment = await find_relevant_norms_many(embeddings, k=5, texts=to_analyze)
+
+    # 4.2-4.6. Параллельный LLM-анализ; вердикт представителя - всем фрагментам
+    # его кластера, каждый отдаётся сразу по готовности
+    member_results: List[Optional[FragmentAnalysis]] = [None] * len(duty_fragments)
+    analyzed_clusters = 0
+    failed = 0
+    analyzed = 0
+    async for pos, result in _iter_analyzed_fragments(
+        to_analyze,
+        norms_per_fragment,
+        concurrency=settings.analysis_concurrency,
+        time_budget=settings.analysis_time_budget,
+    ):
+        analyzed_clusters += 1
+        failed += result.label == RiskLabel.failed
+        cluster = clusters_to_analyze[pos]
+        for i in cluster:
+            member_results[i] = (
+                result if i == cluster[0]
+                else result.model_copy(update={"fragment_text": duty_fragments[i]})
+            )
+            yield FragmentReady(number=i + 1, fragment=member_results[i])
+        analyzed += len(cluster)
+        yield AnalysisProgress(
+            stage="analyzing",
+            fragments_total=len(fragments_text),
+            fragments_on_topic=len(duty_fragments),
+            analyzed=analyzed,
         )
 
-        # 4.3. Маппим label
-        label_str = (llm_result.get("label") or "OK").strip()
-        if label_str.upper() == "RISK" or label_str == "Риск":
-            label = RiskLabel.risk
-        elif label_str.upper() == "OK" or label_str == "ОК":
-            label = RiskLabel.ok
-        else:
-            label = RiskLabel.ok
-
-        comment = llm_result.get("comment") or ""
-        correct_position = llm_result.get("correct_position") or ""
-
-        # 4.4. Источники: берём только те, индексы которых вернула модель
-        idx_list = llm_result.get("source_indices") or []
-        sources: List[SourceRef] = []
-
-        for i in idx_list:
-            try:
-                i_int = int(i)
-                if 0 <= i_int < len(norms):
-                    n: NormItem = norms[i_int]
-                    sources.append(
-                        SourceRef(
-                            type=n.type,
-                            number=n.number,
-                            short_title=n.short_title,
-                            url=None,  # url можно добавить в метадату Pinecone, если понадобится
-                        )
-                    )
-            except Exception:
-                continue
+    fragments_models: List[FragmentAnalysis] = [r for r in member_results if r is not None]
 
-        # Если модель не выбрала ничего – подставим все найденные нормы, чтобы источники были обязательно
-        if not sources:
-            sources = [
-                SourceRef(
-                    type=n.type,
-                    number=n.number,
-                    short_title=n.short_title,
-                    url=None,
-                )
-                for n in norms
-            ] or [
+    # Честно сообщаем, если что-то не успели или не стали анализировать
+    not_analyzed = len(duty_fragments) - analyzed
+    if not_analyzed:
+        note = FragmentAnalysis(
+            fragment_text=(
+                f"Не проанализировано фрагментов по теме: {not_analyzed} "
+                f"из {len(duty_fragments)}."
+            ),
+            label=RiskLabel.ok,
+            comment="Сработал лимит на количество фрагментов или на время анализа.",
+            correct_position=(
+                "Разбейте документ на части или отправьте только разделы "
+                "про госпошлину, чтобы проверить оставшиеся фрагменты."
+            ),
+            sources=[
                 SourceRef(
                     type="Доктрина",
                     number="N/A",
-                    short_title="Источники не указаны моделью",
+                    short_title="Технический комментарий бота",
                     url=None,
                 )
-            ]
-        # Убираем дубликаты источников
-        unique = {}
-        for s in sources:
-            key = (s.type, s.number, s.short_title, s.url)
-            if key not in unique:
-                unique[key] = s
-        sources = list(unique.values())
-
-        # 4.5. Собираем результат по фрагменту
-        fragments_models.append(
-            FragmentAnalysis(
-                fragment_text=frag_text,  # чистый текст фрагмента
-                label=label,
-                comment=comment,
-                correct_position=correct_position,
-                sources=sources,
-            )
+            ],
+        )
+        fragments_models.append(note)
+        yield FragmentReady(number=len(duty_fragments) + 1, fragment=note)
+
+    # результат, обрезанный по времени или с ошибками модели, не должен попадать в кеш результатов
+    timed_out = analyzed_clusters < len(clusters_to_analyze)
+    if failed:
+        print(f"[WARN] Модель не дала валидный ответ по {failed} фрагм.")
+    yield AnalysisDone(
+        DocumentAnalysis(
+            topic=topic,
+            fragments=fragments_models,
+            complete=not timed_out and not failed,
+        )
+    )
+
+
+async def _iter_analyzed_fragments(
+    fragments: List[str],
+    norms_per_fragment: List[List[NormItem]],
+    concurrency: int,
+    time_budget: float,
+) -> AsyncIterator[Tuple[int, FragmentAnalysis]]:
+    """
+    Запускает анализ фрагментов параллельно, не больше concurrency запросов одновременно.
+    В режиме "batch" несколько фрагментов уходят в LLM одним запросом.
+    Отдаёт (индекс фрагмента, результат) по мере готовности; фрагменты,
+    не уложившиеся в time_budget (секунды, 0 - без лимита), отменяются
+    и не отдаются вовсе.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    norms_for_llm = [_norms_for_llm(norms) for norms in norms_per_fragment]
+
+    if settings.analysis_mode.lower().strip() == "batch":
+        groups = pack_fragment_batches(
+            list(zip(fragments, norms_for_llm)),
+            max_items=settings.analysis_batch_size,
+            max_tokens=settings.analysis_batch_tokens,
         )
+    else:
+        groups = [[i] for i in range(len(fragments))]
+
+    async def _worker(group: List[int]) -> List[FragmentAnalysis]:
+        async with semaphore:
+            if len(group) == 1:
+                i = group[0]
+                llm_results = [
+                    await analyze_fragment_with_norms(
+                        fragment_text=fragments[i],
+                        norms=norms_for_llm[i],
+                    )
+                ]
+            else:
+                llm_results = await analyze_fragments_with_norms(
+                    [(fragments[i], norms_for_llm[i]) for i in group]
+                )
+        return [
+            _build_fragment_analysis(fragments[i], norms_per_fragment[i], llm_result)
+            for i, llm_result in zip(group, llm_results)
+        ]
+
+    tasks = {asyncio.create_task(_worker(group)): group for group in groups}
+    if not tasks:
+        return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + time_budget if time_budget else None
+    pending = set(tasks)
+    try:
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                break  # бюджет времени исчерпан
+
+            # ошибки анализа пробрасываем, как и при последовательной обработке
+            for task in done:
+                for i, fragment_result in zip(tasks[task], task.result()):
+                    yield i, fragment_result
+    finally:
+        # сюда же попадаем, если потребитель перестал читать итератор
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            print(f"[WARN] Анализ прерван (бюджет времени или отмена), отменено запросов: {len(pending)}")
+
+
+def _norms_for_llm(norms: List[NormItem]) -> List[Dict[str, Any]]:
+    # Приводим к простому dict-формату для LLM
+    return [
+        {
+            "id": n.id,
+            "type": n.type,
+            "number": n.number,
+            "short_title": n.short_title,
+            "summary": getattr(n, "summary", ""),
+        }
+        for n in norms
+    ]
+
+
+def _build_fragment_analysis(
+    frag_text: str,
+    norms: List[NormItem],
+    llm_result: Dict[str, Any],
+) -> FragmentAnalysis:
+    """
+    Ответ LLM по одному фрагменту (OK / Риск + комментарий + корректная позиция
+    + индексы источников) -> FragmentAnalysis с маппингом источников.
+    """
+    # 4.3. Маппим label
+    label_str = (llm_result.get("label") or "OK").strip()
+    if label_str == RiskLabel.failed.value:
+        label = RiskLabel.failed
+    elif label_str.upper() == "RISK" or label_str == "Риск":
+        label = RiskLabel.risk
+    elif label_str.upper() == "OK" or label_str == "ОК":
+        label = RiskLabel.ok
+    else:
+        label = RiskLabel.ok
+
+    comment = llm_result.get("comment") or ""
+    correct_position = llm_result.get("correct_position") or ""
+
+    # 4.4. Источники: берём только те, индексы которых вернула модель
+    idx_list = llm_result.get("source_indices") or []
+    sources: List[SourceRef] = []
+
+    for i in idx_list:
+        try:
+            i_int = int(i)
+            if 0 <= i_int < len(norms):
+                n: NormItem = norms[i_int]
+                sources.append(
+                    SourceRef(
+                        type=n.type,
+                        number=n.number,
+                        short_title=n.short_title,
+                        url=None,  # url можно добавить в метадату Pinecone, если понадобится
+                    )
+                )
+        except Exception:
+            continue
+
+    # Вердикта нет - нормы не подтверждают никакого вывода, источник технический
+    if label == RiskLabel.failed:
+        sources = [
+            SourceRef(
+                type="Доктрина",
+                number="N/A",
+                short_title="Технический комментарий бота",
+                url=None,
+            )
+        ]
+    # Если модель не выбрала ничего – подставим все найденные нормы, чтобы источники были обязательно
+    elif not sources:
+        sources = [
+            SourceRef(
+                type=n.type,
+                number=n.number,
+                short_title=n.short_title,
+                url=None,
+            )
+            for n in norms
+        ] or [
+            SourceRef(
+                type="Доктрина",
+                number="N/A",
+                short_title="Источники не указаны моделью",
+                url=None,
+            )
+        ]
+    # Убираем дубликаты источников
+    unique = {}
+    for s in sources:
+        key = (s.type, s.number, s.short_title, s.url)
+        if key not in unique:
+            unique[key] = s
+    sources = list(unique.values())
 
-    return DocumentAnalysis(topic=topic, fragments=fragments_models)
+    # 4.5. Собираем результат по фрагменту
+    return FragmentAnalysis(
+        fragment_text=frag_text,  # чистый текст фрагмента
+        label=label,
+        comment=comment,
+        correct_position=correct_position,
+        sources=sources,
+    )
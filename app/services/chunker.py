@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import re
+from typing import List, Tuple
+
+# Примерные ограничения для чанков базы знаний
+DEFAULT_MAX_CHARS = 1800
+DEFAULT_OVERLAP = 200
+DEFAULT_EXCERPT_CHARS = 600
+
+_PARAGRAPH_RE = re.compile(r"\n[ \t]*\n+")
+# начало нумерованного пункта с новой строки: "12. ", "3.1) ", "п. 12", "пункт 5"
+_POINT_START_RE = re.compile(
+    r"\n(?=[ \t]*(?:\d{1,3}(?:\.\d{1,3})*[.)][ \t]|п\.[ \t]*\d|пункт[ \t]+\d))",
+    re.IGNORECASE,
+)
+# конец предложения: .!? (и закрывающие кавычки/скобки), дальше пробел и заглавная/цифра/кавычка
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])[»\")]*\s+(?=[«\"(А-ЯЁA-Z0-9])")
+
+# Юнит - кусок текста и разделитель, который ставится перед ним при склейке
+Unit = Tuple[str, str]
+
+
+def chunk_text(
+    text: str,
+    max_chars: int = DEFAULT_MAX_CHARS,
+    overlap: int = DEFAULT_OVERLAP,
+) -> List[str]:
+    """
+    Режет текст на чанки не длиннее max_chars с учётом структуры:
+      1) абзацы (пустые строки),
+      2) нумерованные пункты ("12.", "п. 12") внутри абзаца,
+      3) предложения - если пункт/абзац длиннее max_chars,
+      4) слова - если длиннее max_chars даже предложение.
+    Юниты склеиваются жадно; следующий чанк начинается с хвоста
+    предыдущего (целыми юнитами, не длиннее overlap символов).
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n").strip()
+    if not text:
+        return []
+    if len(text) <= max_chars:
+        return [text]
+
+    units = _split_units(text, max_chars)
+    return _pack_units(units, max_chars, overlap)
+
+
+def make_excerpt(text: str, max_chars: int = DEFAULT_EXCERPT_CHARS) -> str:
+    """
+    Короткая выдержка из чанка для metadata: обрезка по концу предложения
+    (или по пробелу), чтобы не рвать слово.
+    """
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+
+    cut = text[:max_chars]
+    sentence_end = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "))
+    if sentence_end >= max_chars // 2:
+        return cut[:sentence_end + 1]
+
+    space = cut.rfind(" ")
+    if space > 0:
+        cut = cut[:space]
+    return cut + "…"
+
+
+def _split_units(text: str, max_chars: int) -> List[Unit]:
+    units: List[Unit] = []
+
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+
+        first_in_paragraph = True
+        for point in _POINT_START_RE.split(paragraph):
+            point = point.strip()
+            if not point:
+                continue
+
+            sep = "\n\n" if first_in_paragraph else "\n"
+            first_in_paragraph = False
+
+            if len(point) <= max_chars:
+                units.append((point, sep))
+                continue
+
+            for i, sentence in enumerate(_split_sentences(point, max_chars)):
+                units.append((sentence, sep if i == 0 else " "))
+
+    return units
+
+
+def _split_sentences(block: str, max_chars: int) -> List[str]:
+    result: List[str] = []
+    for sentence in _SENTENCE_END_RE.split(block):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            result.append(sentence)
+        else:
+            result.extend(_split_words(sentence, max_chars))
+    return result
+
+
+def _split_words(sentence: str, max_chars: int) -> List[str]:
+    """
+    Последний рубеж: режем по пробелу ближе к max_chars, без пробелов - жёстко.
+    """
+    result: List[str] = []
+    start, n = 0, len(sentence)
+    while n - start > max_chars:
+        split_pos = sentence.rfind(" ", start, start + max_chars)
+        if split_pos <= start:
+            split_pos = start + max_chars
+        result.append(sentence[start:split_pos].strip())
+        start = split_pos
+        while start < n and sentence[start].isspace():
+            start += 1
+    if start < n:
+        result.append(sentence[start:])
+    return [r for r in result if r]
+
+
+def _join(units: List[Unit]) -> str:
+    return "".join((sep if i else "") + text for i, (text, sep) in enumerate(units))
+
+
+def _pack_units(units: List[Unit], max_chars: int, overlap: int) -> List[str]:
+    chunks: List[str] = []
+    current: List[Unit] = []
+    current_len = 0
+    # сколько юнитов в начале current пришло из перекрытия
+    carried = 0
+
+    for text, sep in units:
+        add_len = len(text) + (len(sep) if current else 0)
+
+        if current and current_len + add_len > max_chars:
+            if len(current) > carried:
+                chunks.append(_join(current))
+
+            # перекрытие: целые юниты с конца, в сумме не длиннее overlap
+            tail: List[Unit] = []
+            tail_len = 0
+            for unit in reversed(current):
+                unit_len = len(unit[0]) + len(unit[1])
+                if tail_len + unit_len > overlap:
+                    break
+                tail.insert(0, unit)
+                tail_len += unit_len
+
+            current = tail
+            current_len = len(_join(current))
+            carried = len(current)
+            if current and current_len + len(text) + len(sep) > max_chars:
+                current, current_len, carried = [], 0, 0
+            add_len = len(text) + (len(sep) if current else 0)
+
+        current.append((text, sep))
+        current_len += add_len
+
+    if current and len(current) > carried:
+        chunks.append(_join(current))
+
+    return chunks
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import Dict, List, Sequence
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3             # шинглы - тройки слов
+# Фрагменты с расстоянием Хэмминга <= 10 бит считаются почти дубликатами.
+# Фрагменты короткие (десятки слов), поэтому правка в одно-два слова меняет
+# заметную долю шинглов (~7 бит в медиане), у разных текстов - от ~20 бит.
+DEFAULT_MAX_DISTANCE = 10
+
+_WORD_RE = re.compile(r"\w+")
+# суммы, даты, проценты, номера статей/пунктов: "300", "333.19", "12.03.2024", "0,5"
+_NUMBER_RE = re.compile(r"\d+(?:[.,/]\d+)*")
+
+
+def _shingles(text: str) -> List[str]:
+    """
+    Нормализованные шинглы: нижний регистр, ё -> е, без пунктуации и
+    лишних пробелов, тройки слов подряд (короткий текст - одним шинглом).
+    """
+    words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+    if len(words) <= SHINGLE_SIZE:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+
+
+def simhash(text: str) -> int:
+    """
+    64-битный SimHash по шинглам: у почти одинаковых текстов
+    отпечатки отличаются в нескольких битах.
+    """
+    weights = [0] * SIMHASH_BITS
+    for shingle in _shingles(text):
+        h = int.from_bytes(
+            hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(),
+            "big",
+        )
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def value_signature(text: str) -> tuple[str, ...]:
+    """
+    Все числа фрагмента по порядку. Почти одинаковые пункты договоров
+    различаются именно суммами, датами и номерами норм, а SimHash такую
+    разницу почти не замечает («300 рублей» / «30000 рублей» - 9 бит).
+    """
+    return tuple(_NUMBER_RE.findall(text))
+
+
+def cluster_near_duplicates(
+    fragments: Sequence[str],
+    max_distance: int = DEFAULT_MAX_DISTANCE,
+) -> List[List[int]]:
+    """
+    Группирует почти одинаковые фрагменты (один и тот же пункт в иске,
+    в ходатайстве, в приложениях). Возвращает кластеры индексов в порядке
+    первого вхождения; первый индекс кластера - его представитель.
+
+    Кандидаты ищутся по полосам отпечатка (LSH): отпечаток режется на
+    max_distance + 1 полос, и по принципу Дирихле у пары с расстоянием
+    <= max_distance хотя бы одна полоса совпадает целиком. Поэтому
+    попарно сравниваются только фрагменты из одной корзины.
+
+    В один кластер попадают только фрагменты с одинаковыми числами
+    (value_signature): вердикт по «300 рублей» нельзя копировать на «30000 рублей».
+    """
+    n = len(fragments)
+    if n < 2:
+        return [[i] for i in range(n)]
+
+    fingerprints = [simhash(frag) for frag in fragments]
+    signatures = [value_signature(frag) for frag in fragments]
+    bands = max_distance + 1
+    band_bits = SIMHASH_BITS // bands
+
+    parent = list(range(n))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(bands):
+        shift = band * band_bits
+        # последняя полоса забирает оставшиеся биты
+        width = SIMHASH_BITS - shift if band == bands - 1 else band_bits
+        mask = (1 << width) - 1
+
+        buckets: Dict[int, List[int]] = {}
+        for i, fp in enumerate(fingerprints):
+            buckets.setdefault((fp >> shift) & mask, []).append(i)
+
+        for members in buckets.values():
+            for a in range(len(members)):
+                for b in range(a + 1, len(members)):
+                    i, j = members[a], members[b]
+                    root_i, root_j = find(i), find(j)
+                    if root_i == root_j or signatures[i] != signatures[j]:
+                        continue
+                    if bin(fingerprints[i] ^ fingerprints[j]).count("1") <= max_distance:
+                        # корнем остаётся более ранний фрагмент - он и будет представителем
+                        parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters: Dict[int, List[int]] = {}
+    for i in range(n):
+        clusters.setdefault(find(i), []).append(i)
+    return list(clusters.values())
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from app.services.text_extractor import (
+    DocumentSource,
+    PoolSource,
+    _pool_extract_docx,
+    _pool_extract_page_range,
+    _pool_pdf_page_count,
+    source_name,
+    to_pool_source,
+)
+from config import settings
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    """
+    Общий ограниченный пул процессов для разбора пользовательских документов.
+    PyPDF2 и docx2txt - чистый Python и держат GIL, поэтому нужны процессы,
+    а не потоки: иначе тяжёлый PDF всё равно тормозит event loop.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(1, settings.extraction_workers))
+    return _pool
+
+
+def shutdown_extraction_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _kill_extraction_pool() -> None:
+    """
+    Убивает процессы пула: воркер, зависший внутри одной страницы или
+    DOCX, сам не остановится, а отмена future его не прерывает.
+    Следующий вызов get_extraction_pool() создаст новый пул; задачи,
+    которые шли в старом, завершатся с BrokenProcessPool.
+    """
+    global _pool
+    pool, _pool = _pool, None
+    if pool is None:
+        return
+    # у ProcessPoolExecutor нет публичного способа убить воркеры (до 3.14)
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def extract_text_async(source: DocumentSource, suffix: str | None = None) -> str:
+    """
+    Асинхронный аналог extract_text для пользовательских файлов:
+    - разбор идёт в пуле процессов, event loop не блокируется;
+    - PDF режется на диапазоны по EXTRACTION_PAGES_PER_TASK страниц,
+      которые читаются параллельно;
+    - на документ действует лимит CPU (EXTRACTION_CPU_BUDGET, делится
+      между частями PDF) и общий таймаут EXTRACTION_TIMEOUT; оба проверяются
+      в воркере между страницами, и PDF возвращается частично - то, что
+      успели прочитать;
+    - DOCX больше EXTRACTION_DOCX_MAX_MB после распаковки не разбирается;
+    - если воркер не вернулся и через EXTRACTION_KILL_GRACE после таймаута
+      (завис внутри одной страницы или DOCX), процессы пула убиваются и пул
+      пересоздаётся, а результат - пустая строка.
+
+    source - путь к файлу или его содержимое (bytes / BytesIO), тогда
+    формат задаётся suffix. DOCX и PDF в одну часть уходят в пул байтами,
+    без записи на диск; PDF из нескольких частей один раз пишется во
+    временный файл, чтобы не пересылать его байты каждой части.
+    """
+    name = source_name(source)
+    if suffix is None and isinstance(source, (str, Path)):
+        suffix = Path(source).suffix
+    suffix = (suffix or "").lower()
+    source = to_pool_source(source)
+
+    timeout = settings.extraction_timeout
+    deadline = time.time() + timeout if timeout else 0.0
+    hard_timeout = timeout + settings.extraction_kill_grace if timeout else None
+
+    try:
+        if suffix == ".pdf":
+            return await asyncio.wait_for(
+                _extract_pdf_parallel(source, name, deadline),
+                timeout=hard_timeout,
+            )
+        if suffix == ".docx":
+            loop = asyncio.get_running_loop()
+            max_uncompressed = int(settings.extraction_docx_max_mb * 1024 * 1024)
+            return await asyncio.wait_for(
+                loop.run_in_executor(get_extraction_pool(), _pool_extract_docx, source, max_uncompressed),
+                timeout=hard_timeout,
+            )
+    except asyncio.TimeoutError:
+        print(f"[ERROR] Таймаут извлечения текста из {name}, перезапускаю пул разбора")
+        _kill_extraction_pool()
+        return ""
+    except BrokenProcessPool:
+        # пул убили из-за чужого зависшего документа или воркер упал сам
+        print(f"[ERROR] Пул разбора сломан во время чтения {name}")
+        if _pool is not None and getattr(_pool, "_broken", False):
+            _kill_extraction_pool()
+        return ""
+
+    print(f"[WARN] Неподдерживаемый формат файла: {name}")
+    return ""
+
+
+async def _extract_pdf_parallel(source: PoolSource, name: str, deadline: float = 0.0) -> str:
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+
+    pages = await loop.run_in_executor(pool, _pool_pdf_page_count, source)
+    if pages <= 0:
+        print(f"[ERROR] Не удалось прочитать PDF {name}")
+        return ""
+
+    step = max(1, settings.extraction_pages_per_task)
+    ranges = [(start, min(start + step, pages)) for start in range(0, pages, step)]
+    # бюджет CPU делим между частями, чтобы в сумме не превысить лимит на документ
+    cpu_budget = settings.extraction_cpu_budget / len(ranges) if settings.extraction_cpu_budget else 0.0
+
+    # содержимое в памяти уходит в пул байтами на каждую задачу: для многих частей
+    # дешевле один раз записать его во временный файл и раздать воркерам путь
+    tmp_path: Path | None = None
+    if isinstance(source, bytes) and len(ranges) > 1:
+        tmp_path = await asyncio.to_thread(_spill_to_file, source)
+        source = str(tmp_path)
+
+    try:
+        parts_per_range = await asyncio.gather(*(
+            loop.run_in_executor(pool, _pool_extract_page_range, source, a, b, cpu_budget, deadline)
+            for a, b in ranges
+        ))
+    finally:
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+    return "\n\n".join(p for parts in parts_per_range for p in parts)
+
+
+def _spill_to_file(data: bytes) -> Path:
+    with NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+        tmp.write(data)
+    return Path(tmp.name)
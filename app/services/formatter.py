@@ -1,4 +1,4 @@
-from app.models.analysis import DocumentAnalysis, RiskLabel
+from app.models.analysis import DocumentAnalysis, FragmentAnalysis, RiskLabel
 
 
 def format_document_analysis(analysis: DocumentAnalysis) -> str:
@@ -9,22 +9,33 @@ def format_document_analysis(analysis: DocumentAnalysis) -> str:
         return "\n".join(lines)
 
     for idx, frag in enumerate(analysis.fragments, start=1):
-        lines.append(f"<b>Фрагмент {idx}</b>")
-        lines.append(f"{frag.fragment_text}")
-        lines.append(f"Статус: <b>{frag.label.value}</b>")
-
-        if frag.label == RiskLabel.risk:
-            lines.append(f"Комментарий: {frag.comment}")
-            lines.append(f"Корректная позиция: {frag.correct_position}")
-
-        if frag.sources:
-            lines.append("Источники:")
-            for src in frag.sources:
-                base = f"{src.type} {src.number} - {src.short_title}"
-                if src.url:
-                    base += f" ({src.url})"
-                lines.append(f"- {base}")
-
+        lines.append(format_fragment_analysis(idx, frag))
         lines.append("")  # пустая строка между фрагментами
 
     return "\n".join(lines)
+
+
+def format_fragment_analysis(idx: int, frag: FragmentAnalysis) -> str:
+    """
+    Один фрагмент - и в составе отчёта, и отдельным сообщением
+    при поэтапной выдаче результатов.
+    """
+    lines: list[str] = [f"<b>Фрагмент {idx}</b>"]
+    lines.append(f"{frag.fragment_text}")
+    lines.append(f"Статус: <b>{frag.label.value}</b>")
+
+    if frag.label == RiskLabel.risk:
+        lines.append(f"Комментарий: {frag.comment}")
+        lines.append(f"Корректная позиция: {frag.correct_position}")
+    elif frag.label == RiskLabel.failed:
+        lines.append(f"Комментарий: {frag.comment}")
+
+    if frag.sources:
+        lines.append("Источники:")
+        for src in frag.sources:
+            base = f"{src.type} {src.number} - {src.short_title}"
+            if src.url:
+                base += f" ({src.url})"
+            lines.append(f"- {base}")
+
+    return "\n".join(lines)
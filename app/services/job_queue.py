@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+from config import settings
+
+
+class QueueFull(Exception):
+    """
+    Задачу не приняли: у пользователя уже слишком много файлов в работе
+    (per_user=True) или переполнена общая очередь бота.
+    """
+
+    def __init__(self, per_user: bool) -> None:
+        super().__init__("per-user limit" if per_user else "queue is full")
+        self.per_user = per_user
+
+
+@dataclass
+class Job:
+    key: Hashable                             # чей это файл (чат/пользователь)
+    run: Callable[[], Awaitable[Any]]
+    future: "asyncio.Future[Any]"
+    submitted_at: float = field(default_factory=time.monotonic)
+
+
+class JobScheduler:
+    """
+    Планировщик анализов внутри процесса.
+
+    - Фиксированный пул из workers воркеров: одновременно идёт не больше
+      workers тяжёлых пайплайнов, сколько бы файлов ни прислали.
+    - У каждого ключа (чата) не больше per_user_concurrency задач в работе
+      и не больше per_user_queue задач всего (в работе + в очереди).
+    - Общая очередь ограничена max_queue: при переполнении новые задачи
+      отклоняются сразу (backpressure), а не копятся в памяти.
+    - Справедливость: воркер берёт задачи по кругу между чатами (round-robin),
+      поэтому один пользователь с пачкой файлов не блокирует остальных.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        per_user_concurrency: int,
+        per_user_queue: int,
+        max_queue: int,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.per_user_concurrency = max(1, per_user_concurrency)
+        self.per_user_queue = max(1, per_user_queue)
+        self.max_queue = max(1, max_queue)
+
+        self._queues: Dict[Hashable, Deque[Job]] = {}
+        self._rotation: Deque[Hashable] = deque()   # чаты с задачами в очереди, по кругу
+        self._running: Dict[Hashable, int] = {}
+        self._queued = 0
+        self._cond = asyncio.Condition()
+        self._tasks: List[asyncio.Task] = []
+        self._closing = False
+
+    # ------------------------------------------------------------------
+    # Жизненный цикл
+    # ------------------------------------------------------------------
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._closing = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 0.0) -> None:
+        """
+        Останавливает планировщик: новые задачи больше не принимаются,
+        уже принятые дорабатываются не дольше drain_timeout секунд
+        (0 - не ждать), остальные отменяются.
+        """
+        async with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+
+        if not self._tasks:
+            return
+
+        if drain_timeout > 0:
+            done, pending = await asyncio.wait(self._tasks, timeout=drain_timeout)
+            if pending:
+                print(f"[WARN] Не дождались завершения анализов: {self.in_flight}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # что осталось в очереди - отменяем, ожидающие получат CancelledError
+        for queue in self._queues.values():
+            for job in queue:
+                job.future.cancel()
+        self._queues.clear()
+        self._rotation.clear()
+        self._queued = 0
+
+    # ------------------------------------------------------------------
+    # Постановка в очередь
+    # ------------------------------------------------------------------
+    async def submit(self, key: Hashable, run: Callable[[], Awaitable[Any]]) -> Job:
+        """
+        Ставит задачу в очередь. Результат run() - в job.future.
+        Бросает QueueFull, если лимиты исчерпаны (или планировщик остановлен).
+        """
+        async with self._cond:
+            if self._closing or not self._tasks:
+                raise QueueFull(per_user=False)
+
+            queue = self._queues.get(key)
+            user_total = self._running.get(key, 0) + (len(queue) if queue else 0)
+            if user_total >= self.per_user_queue:
+                raise QueueFull(per_user=True)
+            if self._queued >= self.max_queue:
+                raise QueueFull(per_user=False)
+
+            job = Job(key=key, run=run, future=asyncio.get_running_loop().create_future())
+            if queue is None:
+                queue = self._queues[key] = deque()
+                self._rotation.append(key)
+            queue.append(job)
+            self._queued += 1
+
+            self._cond.notify_all()
+            return job
+
+    def position(self, job: Job) -> int:
+        """
+        Примерная позиция задачи в очереди (1 - следующая), с учётом
+        очерёдности по кругу: из каждого другого чата перед ней пройдёт
+        столько задач, сколько кругов до её хода (чаты раньше по кругу -
+        на одну больше). 0 - задача уже выполняется или завершена.
+        """
+        queue = self._queues.get(job.key)
+        if not queue or job not in queue:
+            return 0
+        ahead_own = queue.index(job)
+        rotation = list(self._rotation)
+        my_turn = rotation.index(job.key)
+        ahead_other = 0
+        for turn, key in enumerate(rotation):
+            if key == job.key:
+                continue
+            rounds = ahead_own + 1 if turn < my_turn else ahead_own
+            ahead_other += min(len(self._queues[key]), rounds)
+        return ahead_own + ahead_other + 1
+
+    @property
+    def accepting(self) -> bool:
+        """Планировщик запущен и принимает новые задачи (не остановлен и не в дренаже)."""
+        return bool(self._tasks) and not self._closing
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._running.values())
+
+    # ------------------------------------------------------------------
+    # Воркеры
+    # ------------------------------------------------------------------
+    def _take_next(self) -> Optional[Job]:
+        for _ in range(len(self._rotation)):
+            key = self._rotation.popleft()
+            queue = self._queues[key]
+            if self._running.get(key, 0) >= self.per_user_concurrency:
+                # у чата уже максимум задач в работе - пропускаем его ход
+                self._rotation.append(key)
+                continue
+
+            job = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._rotation.append(key)
+            else:
+                del self._queues[key]
+            return job
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._cond:
+                job = self._take_next()
+                while job is None:
+                    if self._closing and not self._queued:
+                        return
+                    await self._cond.wait()
+                    job = self._take_next()
+                self._running[job.key] = self._running.get(job.key, 0) + 1
+
+            try:
+                # ожидающий мог уже отказаться от задачи (отмена) - тогда не запускаем
+                if not job.future.done():
+                    try:
+                        result = await job.run()
+                    except asyncio.CancelledError:
+                        job.future.cancel()
+                        raise
+                    except Exception as e:
+                        if not job.future.done():
+                            job.future.set_exception(e)
+                    else:
+                        if not job.future.done():
+                            job.future.set_result(result)
+            finally:
+                async with self._cond:
+                    self._running[job.key] -= 1
+                    if not self._running[job.key]:
+                        del self._running[job.key]
+                    self._cond.notify_all()
+
+
+_scheduler: JobScheduler | None = None
+
+
+def get_job_scheduler() -> JobScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = JobScheduler(
+            workers=settings.job_workers,
+            per_user_concurrency=settings.job_per_user_concurrency,
+            per_user_queue=settings.job_per_user_queue,
+            max_queue=settings.job_max_queue,
+        )
+    return _scheduler
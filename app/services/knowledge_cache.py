@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import List, Optional
+
+
+class KnowledgeTextCache:
+    """
+    Кеш извлечённого текста PDF базы знаний в одном файле SQLite.
+
+    - Ключ: путь относительно data/knowledge + sha256 содержимого PDF,
+      поэтому одноимённые файлы из разных папок не перетирают друг друга,
+      а изменённый файл (даже с тем же mtime) не даёт ложного попадания.
+    - Каждая страница сжата zlib отдельно, все страницы лежат одним BLOB,
+      рядом - смещения страниц. Отдельную страницу можно прочитать через
+      substr(), не распаковывая весь документ.
+    - Запись - одна транзакция, поэтому её можно безопасно делать
+      из нескольких процессов пула.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.path),
+            timeout=60.0,
+            check_same_thread=False,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pdf_text ("
+            " rel_path TEXT PRIMARY KEY,"
+            " sha256 TEXT NOT NULL,"
+            " pages INTEGER NOT NULL,"
+            " chars INTEGER NOT NULL,"
+            " offsets TEXT NOT NULL,"   # JSON: [0, конец стр. 0, конец стр. 1, ...]
+            " data BLOB NOT NULL,"
+            " created_at REAL NOT NULL"
+            ")"
+        )
+        self._conn.commit()
+
+    def get_pages(self, rel_path: str, sha256: str) -> Optional[List[str]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT offsets, data FROM pdf_text WHERE rel_path = ? AND sha256 = ?",
+                (rel_path, sha256),
+            ).fetchone()
+        if row is None:
+            return None
+
+        offsets = json.loads(row[0])
+        data: bytes = row[1]
+        return [
+            zlib.decompress(data[offsets[i]:offsets[i + 1]]).decode("utf-8")
+            for i in range(len(offsets) - 1)
+        ]
+
+    def get_text(self, rel_path: str, sha256: str) -> Optional[str]:
+        pages = self.get_pages(rel_path, sha256)
+        return "\n\n".join(pages) if pages is not None else None
+
+    def get_page(self, rel_path: str, sha256: str, page: int) -> Optional[str]:
+        """
+        Ленивое чтение одной страницы: из БД достаётся только её кусок BLOB.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT offsets FROM pdf_text WHERE rel_path = ? AND sha256 = ?",
+                (rel_path, sha256),
+            ).fetchone()
+            if row is None:
+                return None
+            offsets = json.loads(row[0])
+            if not 0 <= page < len(offsets) - 1:
+                return None
+            start, end = offsets[page], offsets[page + 1]
+            (chunk,) = self._conn.execute(
+                # substr в SQLite 1-based
+                "SELECT substr(data, ?, ?) FROM pdf_text WHERE rel_path = ?",
+                (start + 1, end - start, rel_path),
+            ).fetchone()
+        return zlib.decompress(chunk).decode("utf-8")
+
+    def put(self, rel_path: str, sha256: str, pages: List[str]) -> None:
+        blobs = [zlib.compress(p.encode("utf-8"), 6) for p in pages]
+        offsets = [0]
+        for b in blobs:
+            offsets.append(offsets[-1] + len(b))
+
+        chars = sum(len(p) for p in pages) + 2 * max(0, len(pages) - 1)
+        with self._lock:
+            with self._conn:  # транзакция: либо запись целиком, либо ничего
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO pdf_text "
+                    "(rel_path, sha256, pages, chars, offsets, data, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        rel_path,
+                        sha256,
+                        len(pages),
+                        chars,
+                        json.dumps(offsets),
+                        b"".join(blobs),
+                        time.time(),
+                    ),
+                )
+
+
+_cache: KnowledgeTextCache | None = None
+_cache_pid: int | None = None
+
+
+def get_knowledge_cache(path: Path) -> KnowledgeTextCache:
+    """
+    Кеш на процесс: соединение SQLite нельзя тащить через fork,
+    поэтому в процессе-воркере пула открывается своё.
+    """
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = KnowledgeTextCache(path)
+        _cache_pid = os.getpid()
+    return _cache
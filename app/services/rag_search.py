@@ -1,63 +1,95 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import List
+from typing import Dict, List, Sequence, Tuple
 
+from app.integrations.lexical_index import LexicalIndex, get_lexical_index
 from app.integrations.openai_client import get_embedding
-from app.integrations.pinecone_client import get_pinecone_index
+from app.integrations.vector_store import NormItem, get_vector_store, norm_from_metadata
+from config import settings
 
+__all__ = ["NormItem", "find_relevant_norms", "find_relevant_norms_many"]
 
-@dataclass
-class NormItem:
+
+async def find_relevant_norms(
+    fragment_text: str,
+    k: int = 5,
+    embedding: Sequence[float] | None = None,
+) -> List[NormItem]:
     """
-    Одна норма/позиция из базы:
-    - ПП ВС РФ / КС РФ / доктрина.
+    Строит эмбеддинг фрагмента и ищет релевантные нормы в векторном хранилище
+    (Pinecone или локальное - см. VECTOR_STORE_BACKEND).
+    Если эмбеддинг уже посчитан (например, батчем в анализаторе),
+    его можно передать через embedding — повторного запроса не будет.
+    Если построен лексический индекс, результаты сливаются с BM25 (RRF).
     """
-    type: str          # "ПП ВС РФ", "КС РФ", "Доктрина"
-    number: str        # № постановления / определения / статьи
-    short_title: str   # краткое текстовое описание
-    url: str | None    # ссылка (если есть)
-    summary: str       # 2–3 предложения по сути нормы
+    if embedding is None:
+        embedding = await get_embedding(fragment_text)
 
+    store = get_vector_store()
+    lexical = get_lexical_index()
+    if lexical is None:
+        return await store.search(embedding, k=k)
 
-async def find_relevant_norms(
-    fragment_text: str,
+    vector_hits = await store.search(embedding, k=max(k, settings.hybrid_candidates))
+    return _fuse(vector_hits, _lexical_hits(lexical, fragment_text), k)
+
+
+async def find_relevant_norms_many(
+    embeddings: Sequence[Sequence[float]],
     k: int = 5,
+    texts: Sequence[str] | None = None,
+) -> List[List[NormItem]]:
+    """
+    Поиск норм сразу для всех фрагментов документа по готовым эмбеддингам.
+    Запросы выполняются параллельно (для Pinecone - вне event loop,
+    с ограничением параллельности), порядок результатов совпадает с входом.
+    Если переданы тексты фрагментов и есть лексический индекс - гибридный поиск.
+    """
+    if not embeddings:
+        return []
+
+    store = get_vector_store()
+    lexical = get_lexical_index() if texts is not None else None
+    if lexical is None:
+        return await store.search_many(embeddings, k=k)
+
+    vector_hits = await store.search_many(embeddings, k=max(k, settings.hybrid_candidates))
+    return [
+        _fuse(hits, _lexical_hits(lexical, text), k)
+        for hits, text in zip(vector_hits, texts)  # type: ignore[arg-type]
+    ]
+
+
+def _lexical_hits(lexical: LexicalIndex, text: str) -> List[NormItem]:
+    return [
+        norm_from_metadata(lexical.metadata[doc_id], doc_id)
+        for doc_id, _ in lexical.search(text, k=settings.hybrid_candidates)
+    ]
+
+
+def _norm_key(norm: NormItem) -> Tuple[str, ...]:
+    return (norm.id,) if norm.id else (norm.type, norm.number, norm.short_title)
+
+
+def _fuse(
+    vector_hits: List[NormItem],
+    lexical_hits: List[NormItem],
+    k: int,
 ) -> List[NormItem]:
     """
-    Строит эмбеддинг фрагмента и ищет релевантные нормы в Pinecone.
-    Ожидается, что в metadata хранятся:
-      - type
-      - number
-      - short_title
-      - url
-      - summary
+    Reciprocal rank fusion: счёт нормы - сумма 1 / (rrf_k + ранг) по обоим спискам.
+    Норма, найденная и по смыслу, и по точной ссылке, поднимается наверх;
+    шкалы счётов (косинус и BM25) при этом сравнивать не нужно.
     """
-    embedding = await get_embedding(fragment_text)
-    index = get_pinecone_index()
-
-    res = index.query(
-        vector=embedding,
-        top_k=k,
-        include_metadata=True,
-    )
-
-    # в новом SDK res может быть dict или объект – обрабатываем оба варианта
-    matches = res["matches"] if isinstance(res, dict) else res.matches
-
-    norms: List[NormItem] = []
-
-    for m in matches or []:
-        md = m["metadata"] if isinstance(m, dict) else getattr(m, "metadata", {}) or {}
-
-        norms.append(
-            NormItem(
-                type=str(md.get("type", "")),
-                number=str(md.get("number", "")),
-                short_title=str(md.get("short_title", "")),
-                url=md.get("url"),
-                summary=str(md.get("summary", "")),
-            )
-        )
-
-    return norms
+    rrf_k = settings.hybrid_rrf_k
+    scores: Dict[Tuple[str, ...], float] = {}
+    items: Dict[Tuple[str, ...], NormItem] = {}
+
+    for hits in (vector_hits, lexical_hits):
+        for rank, norm in enumerate(hits):
+            key = _norm_key(norm)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            items.setdefault(key, norm)
+
+    ranked = sorted(scores, key=scores.__getitem__, reverse=True)
+    return [items[key] for key in ranked[:k]]
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+from app.integrations.cache_store import CacheStats, SqliteCache
+from app.integrations.openai_client import BATCH_PROMPT_VERSION, PROMPT_VERSION
+from app.models.analysis import DocumentAnalysis
+from app.services.topic_semantic import DEFAULT_PROTOTYPES_PATH
+from config import settings
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_CACHE_PATH = BASE_DIR / "data" / "cache" / "results.sqlite3"
+
+_cache: SqliteCache | None = None
+
+# анализы, которые выполняются прямо сейчас: ключ по хешу содержимого -> задача
+_inflight: Dict[str, "asyncio.Task[DocumentAnalysis]"] = {}
+
+
+def get_result_cache() -> SqliteCache | None:
+    """
+    Кеш готовых DocumentAnalysis. Один и тот же файл, пересланный повторно
+    или загруженный коллегой, отдаётся мгновенно и без запросов к API.
+    Возвращает None, если кеш выключен в настройках.
+    """
+    global _cache
+    if not settings.result_cache_enabled:
+        return None
+    if _cache is None:
+        path = Path(settings.result_cache_path or DEFAULT_CACHE_PATH)
+        _cache = SqliteCache(
+            path=path,
+            table="results",
+            max_entries=settings.result_cache_max_entries,
+            ttl=settings.result_cache_ttl,
+        )
+    return _cache
+
+
+def content_sha256(source: Union[str, Path, bytes]) -> str:
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    h = hashlib.sha256()
+    with Path(source).open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _pipeline_fingerprint() -> str:
+    """
+    Короткий хеш настроек, от которых зависит результат анализа: режим
+    анализа, дедупликация, семантический фильтр (и версия файла прототипов),
+    гибридный поиск. После смены любой из них старые результаты не используются.
+    """
+    config = {
+        "analysis_mode": settings.analysis_mode.lower().strip(),
+        "batch_prompt": BATCH_PROMPT_VERSION,
+        "batch_size": settings.analysis_batch_size,
+        "batch_tokens": settings.analysis_batch_tokens,
+        "dedup": settings.dedup_enabled,
+        "dedup_distance": settings.dedup_max_distance,
+        "semantic": settings.topic_semantic_filter,
+        "hybrid": settings.hybrid_search_enabled,
+        "hybrid_candidates": settings.hybrid_candidates,
+        "rrf_k": settings.hybrid_rrf_k,
+    }
+    if settings.topic_semantic_filter:
+        path = Path(settings.topic_prototypes_path or DEFAULT_PROTOTYPES_PATH)
+        config.update(
+            semantic_threshold=settings.topic_semantic_threshold,
+            semantic_threshold_no_keyword=settings.topic_semantic_threshold_no_keyword,
+            # прототипы перестроили - результаты фильтра другие
+            prototypes_mtime=path.stat().st_mtime_ns if path.exists() else None,
+        )
+    raw = json.dumps(config, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:12]
+
+
+def _file_key(file_unique_id: str, topic: str) -> str:
+    # версия промпта и настроек пайплайна в ключе: после их смены старые результаты не используются
+    return f"{PROMPT_VERSION}:{_pipeline_fingerprint()}:{topic}:file:{file_unique_id}"
+
+
+def _content_key(content_hash: str, topic: str) -> str:
+    return f"{PROMPT_VERSION}:{_pipeline_fingerprint()}:{topic}:sha256:{content_hash}"
+
+
+async def _get(key: str) -> Optional[DocumentAnalysis]:
+    cache = get_result_cache()
+    if cache is None:
+        return None
+    try:
+        blob = await asyncio.to_thread(cache.get, key)
+    except Exception as e:
+        # недоступный кеш - просто промах, анализ идёт как обычно
+        print(f"[WARN] Не удалось прочитать результат из кеша: {e}")
+        return None
+    if blob is None:
+        return None
+    try:
+        return DocumentAnalysis.model_validate_json(blob)
+    except Exception:
+        return None
+
+
+async def _store(keys: list[str], analysis: DocumentAnalysis) -> None:
+    cache = get_result_cache()
+    if cache is None or not analysis.complete:
+        return
+    blob = analysis.model_dump_json().encode("utf-8")
+    try:
+        await asyncio.to_thread(cache.set_many, {key: blob for key in keys})
+    except Exception as e:
+        print(f"[WARN] Не удалось записать результат в кеш: {e}")
+
+
+async def get_cached_by_file_id(file_unique_id: str, topic: str) -> Optional[DocumentAnalysis]:
+    """
+    Быстрая проверка до скачивания файла: Telegram выдаёт один и тот же
+    file_unique_id для пересланного файла.
+    """
+    return await _get(_file_key(file_unique_id, topic))
+
+
+async def analyze_once(
+    content_hash: str,
+    topic: str,
+    run: Callable[[], Awaitable[DocumentAnalysis]],
+    file_unique_id: str | None = None,
+) -> DocumentAnalysis:
+    """
+    Возвращает результат анализа документа с данным содержимым:
+      1) из кеша по хешу содержимого;
+      2) если такой же документ уже анализируется - ждёт тот же анализ
+         (single-flight), а не запускает второй;
+      3) иначе запускает run() и кладёт результат в кеш
+         (по хешу и по file_unique_id).
+    """
+    content_key = _content_key(content_hash, topic)
+
+    cached = await _get(content_key)
+    if cached is not None:
+        if file_unique_id:
+            await _store([_file_key(file_unique_id, topic)], cached)
+        return cached
+
+    task = _inflight.get(content_key)
+    if task is None:
+        task = asyncio.create_task(run())
+        _inflight[content_key] = task
+        task.add_done_callback(
+            lambda t: _inflight.pop(content_key, None) if _inflight.get(content_key) is t else None
+        )
+
+    # shield: отмена одного ожидающего не должна отменять анализ для остальных
+    analysis = await asyncio.shield(task)
+
+    keys = [content_key]
+    if file_unique_id:
+        keys.append(_file_key(file_unique_id, topic))
+    await _store(keys, analysis)
+
+    return analysis
+
+
+def invalidate_result_cache() -> None:
+    """
+    Сбрасывает кеш результатов (после переиндексации базы знаний).
+    """
+    cache = get_result_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def get_result_cache_stats() -> CacheStats | None:
+    cache = get_result_cache()
+    return cache.stats() if cache is not None else None
@@ -1,97 +1,158 @@
 from __future__ import annotations
 
-from typing import List
+import re
+from typing import Iterator, List, Tuple
 
 
 # Примерные ограничения, потом можно подкрутить
 MIN_FRAGMENT_LEN = 100      # минимальная длина фрагмента в символах
 MAX_FRAGMENT_LEN = 800      # максимальная длина фрагмента в символах
 
+# Пустая строка = два перевода строки подряд (\r\n, \r или \n)
+_EMPTY_LINE_RE = re.compile(r"(?:\r\n|\r(?!\n)|\n){2}")
+
+Span = Tuple[int, int]
+
 
 def split_into_fragments(text: str) -> List[str]:
     """
     Делит текст на смысловые фрагменты:
     - сначала по пустым строкам (абзацы),
     - слишком длинные абзацы дополнительно режет на куски.
+
+    Тонкая обёртка над iter_fragment_block_spans: строки собираются
+    только здесь, сама разбивка идёт по позициям в исходном тексте.
     """
     if not text:
         return []
 
-    # нормализуем перевод строк
-    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return [
+        "\n\n".join(_normalize_newlines(text[start:end]) for start, end in blocks)
+        for blocks in iter_fragment_block_spans(text)
+    ]
 
-    raw_blocks = _split_by_empty_lines(text)
-    blocks: list[str] = []
 
-    # чистим и режем длинные блоки
-    for block in raw_blocks:
-        block = block.strip()
-        if not block:
-            continue
+def iter_fragment_spans(text: str) -> Iterator[Span]:
+    """
+    Границы фрагментов (start, end) в исходном тексте - для подсветки в отчётах.
+    text[start:end] - фрагмент вместе с разделителями между склеенными абзацами.
+    """
+    for blocks in iter_fragment_block_spans(text):
+        yield blocks[0][0], blocks[-1][1]
 
-        if len(block) <= MAX_FRAGMENT_LEN:
-            blocks.append(block)
-        else:
-            blocks.extend(_split_long_block(block, max_len=MAX_FRAGMENT_LEN))
 
-    # можно ещё склеивать слишком короткие блоки
-    merged = _merge_short_blocks(blocks, min_len=MIN_FRAGMENT_LEN)
+def iter_fragment_block_spans(text: str) -> Iterator[List[Span]]:
+    """
+    Генератор фрагментов: каждый фрагмент - список span'ов абзацев/кусков,
+    из которых он склеен. Один проход по тексту, без промежуточных копий.
+    """
+    return _merge_short_blocks(text, _iter_block_spans(text), min_len=MIN_FRAGMENT_LEN)
+
+
+def _normalize_newlines(text: str) -> str:
+    return text.replace("\r\n", "\n").replace("\r", "\n")
 
-    return merged
+
+def _logical_len(text: str, start: int, end: int) -> int:
+    """
+    Длина text[start:end] после нормализации переводов строк:
+    \r\n считается одним символом, как в строках, которые получит вызывающий.
+    """
+    return (end - start) - text.count("\r\n", start, end)
 
 
-def _split_by_empty_lines(text: str) -> List[str]:
+def _advance(text: str, start: int, end: int, n: int) -> int:
     """
-    Разбивает текст по пустым строкам (двойной перевод строки).
+    Позиция в исходном тексте после n нормализованных символов от start
+    (не дальше end); пара \r\n не разрывается.
     """
-    parts = text.split("\n\n")
-    return parts
+    pos = start
+    while n > 0 and pos < end:
+        nxt = min(pos + n, end)
+        if nxt < end and text[nxt - 1] == "\r" and text[nxt] == "\n":
+            nxt += 1
+        n -= _logical_len(text, pos, nxt)
+        pos = nxt
+    return pos
 
 
-def _split_long_block(block: str, max_len: int) -> List[str]:
+def _strip_span(text: str, start: int, end: int) -> Span:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _iter_block_spans(text: str) -> Iterator[Span]:
     """
-    Делит длинный блок на куски не длиннее max_len, стараясь резать по пробелам.
+    Абзацы (по пустым строкам) без пробелов по краям;
+    слишком длинные абзацы дополнительно режутся на куски.
     """
-    result: list[str] = []
+    pos = 0
+    for sep in _EMPTY_LINE_RE.finditer(text):
+        yield from _iter_paragraph_spans(text, pos, sep.start())
+        pos = sep.end()
+    yield from _iter_paragraph_spans(text, pos, len(text))
+
+
+def _iter_paragraph_spans(text: str, start: int, end: int) -> Iterator[Span]:
+    start, end = _strip_span(text, start, end)
+    if start == end:
+        return
 
-    current = block.strip()
-    while len(current) > max_len:
+    if _logical_len(text, start, end) <= MAX_FRAGMENT_LEN:
+        yield start, end
+    else:
+        yield from _split_long_block(text, start, end, max_len=MAX_FRAGMENT_LEN)
+
+
+def _split_long_block(text: str, start: int, end: int, max_len: int) -> Iterator[Span]:
+    """
+    Делит длинный блок text[start:end] на куски не длиннее max_len,
+    стараясь резать по пробелам. Работает по индексам - O(длина блока).
+    Длины - в нормализованных символах (\r\n - один символ).
+    """
+    length = _logical_len(text, start, end)
+    while length > max_len:
         # ищем позицию пробела ближе к max_len
-        split_pos = current.rfind(" ", 0, max_len)
+        limit = _advance(text, start, end, max_len)
+        split_pos = text.rfind(" ", start, limit)
         if split_pos == -1:
             # нет пробелов - рубим жестко
-            split_pos = max_len
-
-        part = current[:split_pos].strip()
-        if part:
-            result.append(part)
-        current = current[split_pos:].strip()
+            split_pos = limit
 
-    if current:
-        result.append(current)
+        part_start, part_end = _strip_span(text, start, split_pos)
+        if part_start < part_end:
+            yield part_start, part_end
+        next_start, _ = _strip_span(text, split_pos, end)
+        length -= _logical_len(text, start, next_start)
+        start = next_start
 
-    return result
+    if start < end:
+        yield start, end
 
 
-def _merge_short_blocks(blocks: List[str], min_len: int) -> List[str]:
+def _merge_short_blocks(text: str, blocks: Iterator[Span], min_len: int) -> Iterator[List[Span]]:
     """
     Склеивает слишком короткие куски с соседними, чтобы не было совсем мелкой дроби.
+    Длина склейки считается как при соединении через пустую строку
+    (в нормализованных символах).
     """
-    if not blocks:
-        return []
-
-    merged: list[str] = []
-    buffer = blocks[0]
-
-    for block in blocks[1:]:
-        if len(buffer) < min_len:
+    buffer: List[Span] = []
+    buffer_len = 0
+
+    for start, end in blocks:
+        block_len = _logical_len(text, start, end)
+        if not buffer:
+            buffer, buffer_len = [(start, end)], block_len
+        elif buffer_len < min_len:
             # добавляем следующий блок к текущему
-            buffer = buffer.rstrip() + "\n\n" + block.lstrip()
+            buffer.append((start, end))
+            buffer_len += 2 + block_len
         else:
-            merged.append(buffer)
-            buffer = block
+            yield buffer
+            buffer, buffer_len = [(start, end)], block_len
 
     if buffer:
-        merged.append(buffer)
-
-    return merged
+        yield buffer
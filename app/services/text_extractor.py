@@ -1,45 +1,115 @@
 from __future__ import annotations
 
-import json
+import asyncio
+import hashlib
+import io
+import os
 import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Union
+from typing import AsyncIterator, BinaryIO, List, Sequence, Tuple, Union
 
 from PyPDF2 import PdfReader
 from PyPDF2.errors import PdfReadError  # добавь
 import docx2txt  # если ещё не установлено: pip install docx2txt
 
+from app.services.knowledge_cache import get_knowledge_cache
+
 BASE_DIR = Path(__file__).resolve().parents[2]
 KNOWLEDGE_DIR = BASE_DIR / "data" / "knowledge"
 CACHE_DIR = BASE_DIR / "data" / "knowledge_cache"
+CACHE_PATH = CACHE_DIR / "extraction.sqlite3"
+
+# Документ: путь к файлу или его содержимое в памяти (загрузка пользователя)
+DocumentSource = Union[str, Path, bytes, BinaryIO]
+# то, что можно передать в процесс пула: путь строкой или байты
+PoolSource = Union[str, bytes]
+
+UPLOAD_NAME = "<upload>"   # имя для логов, когда документ пришёл байтами
+
+
+def to_pool_source(source: DocumentSource) -> PoolSource:
+    """
+    Приводит источник к виду, который можно отправить в процесс пула:
+    путь - строкой, файловый объект - его байтами.
+    """
+    if isinstance(source, (str, bytes)):
+        return source
+    if isinstance(source, Path):
+        return str(source)
+    if isinstance(source, io.BytesIO):
+        return source.getvalue()
+    source.seek(0)
+    return source.read()
+
 
-CACHE_DIR.mkdir(parents=True, exist_ok=True)
+def source_name(source: DocumentSource) -> str:
+    if isinstance(source, (str, Path)):
+        return Path(source).name
+    return UPLOAD_NAME
 
 
-def _get_cache_paths(pdf_path: Path) -> tuple[Path, Path]:
-    safe_name = pdf_path.stem
-    txt_path = CACHE_DIR / f"{safe_name}.txt"
-    meta_path = CACHE_DIR / f"{safe_name}.meta.json"
-    return txt_path, meta_path
+def _open_source(source: PoolSource) -> Union[str, BinaryIO]:
+    # PyPDF2 и docx2txt (zipfile) принимают и путь, и файловый объект
+    return io.BytesIO(source) if isinstance(source, bytes) else source
 
 
-def _is_cache_valid(pdf_path: Path, meta_path: Path) -> bool:
-    if not meta_path.exists():
-        return False
+def _knowledge_rel_path(pdf_path: Path) -> str:
+    """
+    Ключ файла в кеше - путь относительно data/knowledge
+    (для файлов вне базы знаний - абсолютный путь).
+    """
+    resolved = pdf_path.resolve()
     try:
-        meta = json.loads(meta_path.read_text(encoding="utf-8"))
-        pdf_mtime = pdf_path.stat().st_mtime
-        return abs(meta.get("mtime", 0) - pdf_mtime) < 1e-3
-    except Exception:
-        return False
+        return resolved.relative_to(KNOWLEDGE_DIR).as_posix()
+    except ValueError:
+        return resolved.as_posix()
 
 
-def _extract_pdf_with_cache(pdf_path: Path) -> str:
-    txt_path, meta_path = _get_cache_paths(pdf_path)
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _cache_key(pdf_path: Path) -> Tuple[str, str]:
+    return _knowledge_rel_path(pdf_path), _file_sha256(pdf_path)
+
+
+def _read_cached_text(key: Tuple[str, str]) -> str | None:
+    try:
+        return get_knowledge_cache(CACHE_PATH).get_text(*key)
+    except Exception as e:
+        print(f"[WARN] Не удалось прочитать кеш для {key[0]}: {e}")
+        return None
+
+
+def _write_cache(key: Tuple[str, str], pages: List[str]) -> None:
+    # кешируем ТОЛЬКО знания, а не пользовательские файлы
+    try:
+        get_knowledge_cache(CACHE_PATH).put(key[0], key[1], pages)
+    except Exception as e:
+        print(f"[WARN] Не удалось сохранить кеш для {key[0]}: {e}")
 
+
+def read_knowledge_page(pdf_path: Union[str, Path], page: int) -> str | None:
+    """
+    Текст одной страницы PDF базы знаний из кеша (без распаковки всего файла).
+    None - если файла нет в кеше или он изменился.
+    """
+    pdf_path = Path(pdf_path)
+    return get_knowledge_cache(CACHE_PATH).get_page(*_cache_key(pdf_path), page)
+
+
+def _extract_pdf_with_cache(pdf_path: Path) -> str:
     # кеш только для PDF из knowledge
-    if _is_cache_valid(pdf_path, meta_path) and txt_path.exists():
-        return txt_path.read_text(encoding="utf-8")
+    key = _cache_key(pdf_path)
+    cached = _read_cached_text(key)
+    if cached is not None:
+        return cached
 
     t0 = time.time()
     try:
@@ -51,15 +121,7 @@ def _extract_pdf_with_cache(pdf_path: Path) -> str:
         print(f"[ERROR] Ошибка чтения PDF {pdf_path.name}: {e}")
         return ""
 
-    parts = []
-    for page_idx, page in enumerate(reader.pages):
-        try:
-            page_text = page.extract_text() or ""
-        except Exception as e:
-            print(f"[WARN] Ошибка при чтении страницы {page_idx} в {pdf_path.name}: {e}")
-            page_text = ""
-        parts.append(page_text)
-
+    parts = _extract_pages(reader, pdf_path.name, 0, len(reader.pages))
     text = "\n\n".join(parts)
 
     dt = time.time() - t0
@@ -68,77 +130,225 @@ def _extract_pdf_with_cache(pdf_path: Path) -> str:
         f"{len(text)} символов, {dt:.1f} с на парсинг"
     )
 
-    # кешируем ТОЛЬКО знания, а не пользовательские файлы
-    try:
-        txt_path.write_text(text, encoding="utf-8")
-        meta = {
-            "mtime": pdf_path.stat().st_mtime,
-            "pages": len(reader.pages),
-            "chars": len(text),
-        }
-        meta_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
-    except Exception as e:
-        print(f"[WARN] Не удалось сохранить кеш для {pdf_path.name}: {e}")
+    _write_cache(key, parts)
 
     return text
 
 
-def _extract_pdf_no_cache(pdf_path: Path) -> str:
-    try:
-        reader = PdfReader(str(pdf_path))
-    except PdfReadError as e:
-        print(f"[ERROR] Битый PDF {pdf_path.name}: {e}")
-        return ""
-    except Exception as e:
-        print(f"[ERROR] Ошибка чтения PDF {pdf_path.name}: {e}")
-        return ""
-
+def _extract_pages(
+    reader: PdfReader,
+    name: str,
+    start: int,
+    end: int,
+    cpu_budget: float = 0.0,
+    deadline: float = 0.0,
+) -> List[str]:
+    """
+    Текст страниц [start, end). Если задан cpu_budget (секунды CPU) или
+    deadline (момент по time.time()), чтение обрывается на первой странице
+    сверх лимита - возвращается то, что успели прочитать.
+    """
+    t0 = time.process_time()
     parts = []
-    for page_idx, page in enumerate(reader.pages):
+    for page_idx in range(start, end):
+        if cpu_budget and time.process_time() - t0 > cpu_budget:
+            print(
+                f"[WARN] {name}: превышен лимит CPU {cpu_budget:.0f} с, "
+                f"страницы {page_idx}-{end - 1} пропущены"
+            )
+            break
+        if deadline and time.time() > deadline:
+            print(f"[WARN] {name}: истекло время на документ, страницы {page_idx}-{end - 1} пропущены")
+            break
         try:
-            page_text = page.extract_text() or ""
+            page_text = reader.pages[page_idx].extract_text() or ""
         except Exception as e:
-            print(f"[WARN] Ошибка при чтении страницы {page_idx} в {pdf_path.name}: {e}")
+            print(f"[WARN] Ошибка при чтении страницы {page_idx} в {name}: {e}")
             page_text = ""
         parts.append(page_text)
+    return parts
+
+
+# --- функции для процессов пула (должны быть на верхнем уровне модуля) ---
+
+def _pool_extract_knowledge_pdf(path_str: str) -> str:
+    # кеш пишется прямо из процесса-воркера (одной транзакцией SQLite)
+    return _extract_pdf_with_cache(Path(path_str))
+
+
+def _pool_pdf_page_count(source: PoolSource) -> int:
+    try:
+        return len(PdfReader(_open_source(source)).pages)
+    except Exception:
+        return 0
+
+
+def _pool_extract_page_range(
+    source: PoolSource,
+    start: int,
+    end: int,
+    cpu_budget: float = 0.0,
+    deadline: float = 0.0,
+) -> List[str]:
+    reader = PdfReader(_open_source(source))
+    return _extract_pages(reader, source_name(source), start, end, cpu_budget, deadline)
+
+
+def _pool_extract_docx(source: PoolSource, max_uncompressed: int = 0) -> str:
+    return _extract_docx(source, max_uncompressed)
+
+
+async def _extract_knowledge_pdf_in_pool(
+    pool: ProcessPoolExecutor,
+    pdf_path: Path,
+    pages_per_task: int,
+) -> str:
+    loop = asyncio.get_running_loop()
+
+    key = await asyncio.to_thread(_cache_key, pdf_path)
+    cached = await asyncio.to_thread(_read_cached_text, key)
+    if cached is not None:
+        return cached
+
+    if pages_per_task > 0:
+        pages = await loop.run_in_executor(pool, _pool_pdf_page_count, str(pdf_path))
+        if pages > pages_per_task:
+            # большой PDF: режем на диапазоны страниц и читаем их параллельно
+            t0 = time.time()
+            ranges = [
+                (start, min(start + pages_per_task, pages))
+                for start in range(0, pages, pages_per_task)
+            ]
+            parts_per_range = await asyncio.gather(*(
+                loop.run_in_executor(pool, _pool_extract_page_range, str(pdf_path), a, b)
+                for a, b in ranges
+            ))
+            all_pages = [p for parts in parts_per_range for p in parts]
+            text = "\n\n".join(all_pages)
+            print(
+                f"[INFO] Прочитан PDF {pdf_path.name}: {pages} стр. в {len(ranges)} частях, "
+                f"{len(text)} символов, {time.time() - t0:.1f} с на парсинг"
+            )
+            await asyncio.to_thread(_write_cache, key, all_pages)
+            return text
+
+    return await loop.run_in_executor(pool, _pool_extract_knowledge_pdf, str(pdf_path))
+
+
+async def extract_knowledge_pdfs_parallel(
+    paths: Sequence[Path],
+    max_workers: int | None = None,
+    pages_per_task: int = 0,
+) -> AsyncIterator[Tuple[Path, str]]:
+    """
+    Параллельное извлечение текста PDF базы знаний в пуле процессов.
+
+    - Файлы с валидным кешем читаются сразу, без пула.
+    - PDF длиннее pages_per_task страниц (если > 0) режутся на диапазоны,
+      которые читают разные процессы.
+    - Кеш knowledge_cache пишется транзакцией SQLite (из воркера или из родителя).
 
+    Отдаёт пары (путь, текст) по мере готовности (не в исходном порядке).
+    Одновременно в работе не больше 2 * max_workers файлов.
+    """
+    if not paths:
+        return
+
+    max_workers = max_workers or os.cpu_count() or 1
+    in_flight = asyncio.Semaphore(max_workers * 2)
+    ready: asyncio.Queue = asyncio.Queue()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+
+        async def _run(pdf_path: Path) -> None:
+            try:
+                text = await _extract_knowledge_pdf_in_pool(pool, pdf_path, pages_per_task)
+            except Exception as e:
+                print(f"[ERROR] Ошибка чтения PDF {pdf_path.name}: {e}")
+                text = ""
+            await ready.put((pdf_path, text))
+
+        async def _spawn() -> None:
+            for pdf_path in paths:
+                await in_flight.acquire()
+                tasks.append(asyncio.create_task(_run(pdf_path)))
+
+        tasks: List[asyncio.Task] = []
+        spawner = asyncio.create_task(_spawn())
+        try:
+            for _ in range(len(paths)):
+                item = await ready.get()
+                # слот освобождаем, только когда потребитель забрал текст
+                in_flight.release()
+                yield item
+        finally:
+            spawner.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(spawner, *tasks, return_exceptions=True)
+
+
+def _extract_pdf_no_cache(source: PoolSource) -> str:
+    name = source_name(source)
+    try:
+        reader = PdfReader(_open_source(source))
+    except PdfReadError as e:
+        print(f"[ERROR] Битый PDF {name}: {e}")
+        return ""
+    except Exception as e:
+        print(f"[ERROR] Ошибка чтения PDF {name}: {e}")
+        return ""
+
+    parts = _extract_pages(reader, name, 0, len(reader.pages))
     return "\n\n".join(parts)
 
 
-def _extract_docx(docx_path: Path) -> str:
+def _docx_uncompressed_size(source: PoolSource) -> int:
+    with zipfile.ZipFile(_open_source(source)) as zf:
+        return sum(info.file_size for info in zf.infolist())
+
+
+def _extract_docx(source: PoolSource, max_uncompressed: int = 0) -> str:
+    """
+    Текст DOCX. max_uncompressed (байты, 0 - без лимита) - предел размера
+    распакованного архива: docx2txt разбирает XML целиком, и «zip-бомба»
+    иначе съест память и CPU воркера.
+    """
     try:
-        text = docx2txt.process(str(docx_path))
+        if max_uncompressed and _docx_uncompressed_size(source) > max_uncompressed:
+            print(f"[ERROR] DOCX {source_name(source)} слишком велик после распаковки, пропущен")
+            return ""
+        text = docx2txt.process(_open_source(source))
         return text or ""
     except Exception as e:
-        print(f"[ERROR] Не удалось прочитать DOCX {docx_path.name}: {e}")
+        print(f"[ERROR] Не удалось прочитать DOCX {source_name(source)}: {e}")
         return ""
 
 
-def extract_text(path: Union[str, Path]) -> str:
+def extract_text(source: DocumentSource, suffix: str | None = None) -> str:
     """
     Универсальный экстрактор:
     - PDF из data/knowledge -> с кешем
     - любые другие PDF -> без кеша
     - DOCX -> без кеша
+    source - путь или содержимое файла (bytes / файловый объект);
+    для содержимого формат задаётся suffix (".pdf" / ".docx").
     """
-    path = Path(path)
-    suffix = path.suffix.lower()
+    if isinstance(source, (str, Path)):
+        path = Path(source)
+        suffix = suffix or path.suffix
+        # если это наш "knowledge" PDF - кешируем
+        # (resolve: индексатор передаёт относительные пути вида data/knowledge/...)
+        if suffix.lower() == ".pdf" and path.resolve().is_relative_to(KNOWLEDGE_DIR):
+            return _extract_pdf_with_cache(path)
+    suffix = (suffix or "").lower()
 
     if suffix == ".pdf":
-        # если это наш "knowledge" PDF - кешируем
-        try:
-            # Python 3.9+: is_relative_to
-            if path.is_relative_to(KNOWLEDGE_DIR):
-                return _extract_pdf_with_cache(path)
-        except AttributeError:
-            # если 3.8–3.9, можно заменить своей проверкой
-            if str(path).startswith(str(KNOWLEDGE_DIR)):
-                return _extract_pdf_with_cache(path)
         # все остальные pdf -> без кеша
-        return _extract_pdf_no_cache(path)
+        return _extract_pdf_no_cache(to_pool_source(source))
 
     if suffix == ".docx":
-        return _extract_docx(path)
+        return _extract_docx(to_pool_source(source))
 
-    print(f"[WARN] Неподдерживаемый формат файла: {path.name}")
+    print(f"[WARN] Неподдерживаемый формат файла: {source_name(source)}")
     return ""
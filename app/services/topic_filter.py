@@ -1,31 +1,127 @@
 from __future__ import annotations
 
-from typing import Iterable, List
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Sequence, Tuple
 
 
-def filter_fragments_by_topic(
-    fragments: Iterable[str],
-    topic: str,
-) -> List[str]:
+@dataclass(frozen=True)
+class Topic:
     """
-    Очень простой фильтр по теме.
-    На первом этапе поддерживаем только 'госпошлина':
-    ищем по ключевым словам и шаблонам.
+    Тема для фильтрации фрагментов: название, синонимы названия,
+    ключевые слова (ищутся как подстроки без учёта регистра) и шаблоны -
+    регулярные выражения для коротких слов, которые как подстроки дают
+    ложные совпадения («пени» в «степени»): r"\bпени\b", r"\bштраф".
     """
-    topic = topic.lower().strip()
+    name: str
+    keywords: Tuple[str, ...]
+    aliases: Tuple[str, ...] = ()
+    patterns: Tuple[str, ...] = ()
+    min_score: float = 1.0     # сколько совпадений нужно, чтобы фрагмент считался по теме
 
-    if topic == "госпошлина":
-        return _filter_state_duty_fragments(fragments)
 
-    # на будущее - другие темы
-    return list(fragments)
+@dataclass
+class TopicMatch:
+    topic: str
+    score: float = 0.0
+    positions: List[Tuple[int, int]] = field(default_factory=list)   # (start, end) в тексте фрагмента
 
 
-def _filter_state_duty_fragments(fragments: Iterable[str]) -> List[str]:
+class TopicRegistry:
     """
-    Фильтр фрагментов по теме госпошлины.
+    Реестр тем. Все ключевые слова и шаблоны всех тем компилируются в одно
+    регулярное выражение-альтернацию (у каждой ветки своя именованная группа),
+    поэтому фрагмент классифицируется по всем темам за один линейный проход,
+    и добавление темы не умножает стоимость фильтра.
     """
-    keywords = [
+
+    def __init__(self, topics: Iterable[Topic] = ()) -> None:
+        self._topics: Dict[str, Topic] = {}
+        self._aliases: Dict[str, str] = {}
+        self._pattern: re.Pattern[str] | None = None
+        self._group_topics: Dict[str, Tuple[str, ...]] = {}   # имя группы -> темы
+        for topic in topics:
+            self.register(topic)
+
+    def register(self, topic: Topic) -> None:
+        self._topics[topic.name] = topic
+        for alias in (topic.name, *topic.aliases):
+            self._aliases[alias.lower().strip()] = topic.name
+        self._compile()
+
+    def resolve(self, topic: str) -> Topic | None:
+        name = self._aliases.get(topic.lower().strip())
+        return self._topics.get(name) if name else None
+
+    @property
+    def topics(self) -> List[str]:
+        return list(self._topics)
+
+    def _compile(self) -> None:
+        owners: Dict[str, set[str]] = {}
+        pattern_owners: Dict[str, set[str]] = {}
+        for topic in self._topics.values():
+            for kw in topic.keywords:
+                owners.setdefault(kw.lower(), set()).add(topic.name)
+            for pattern in topic.patterns:
+                pattern_owners.setdefault(pattern, set()).add(topic.name)
+        compiled = {p: re.compile(p, re.IGNORECASE) for p in pattern_owners}
+
+        # альтернация находит самое длинное слово в позиции (сортировка по длине),
+        # поэтому длинное слово наследует темы всех более коротких слов и шаблонов,
+        # входящих в него; шаблоны идут после всех слов
+        keywords = sorted(owners, key=len, reverse=True)
+        branches: List[str] = []
+        self._group_topics = {}
+        for i, kw in enumerate(keywords):
+            topics = {t for other, ts in owners.items() if other in kw for t in ts}
+            topics.update(t for p, ts in pattern_owners.items() if compiled[p].search(kw) for t in ts)
+            self._group_topics[f"k{i}"] = tuple(sorted(topics))
+            branches.append(f"(?P<k{i}>{re.escape(kw)})")
+        for i, pattern in enumerate(pattern_owners):
+            self._group_topics[f"p{i}"] = tuple(sorted(pattern_owners[pattern]))
+            branches.append(f"(?P<p{i}>{pattern})")
+
+        self._pattern = re.compile("|".join(branches), re.IGNORECASE) if branches else None
+
+    def classify(self, text: str) -> Dict[str, TopicMatch]:
+        """
+        Один проход по тексту: для каждой найденной темы - позиции совпадений и счёт.
+        """
+        matches: Dict[str, TopicMatch] = {}
+        if self._pattern is None:
+            return matches
+
+        for m in self._pattern.finditer(text):
+            for name in self._group_topics.get(m.lastgroup, ()):
+                match = matches.get(name)
+                if match is None:
+                    match = matches[name] = TopicMatch(topic=name)
+                match.score += 1.0
+                match.positions.append(m.span())
+
+        return matches
+
+    def classify_many(self, fragments: Sequence[str]) -> List[Dict[str, TopicMatch]]:
+        return [self.classify(frag) for frag in fragments]
+
+    def filter(self, fragments: Iterable[str], topic: str) -> List[str]:
+        resolved = self.resolve(topic)
+        if resolved is None:
+            raise KeyError(topic)
+
+        result: List[str] = []
+        for frag in fragments:
+            match = self.classify(frag).get(resolved.name)
+            if match is not None and match.score >= resolved.min_score:
+                result.append(frag)
+        return result
+
+
+STATE_DUTY = Topic(
+    name="госпошлина",
+    aliases=("государственная пошлина",),
+    keywords=(
         "госпошлина",
         "государственная пошлина",
         "гос. пошлина",
@@ -42,13 +138,62 @@ def _filter_state_duty_fragments(fragments: Iterable[str]) -> List[str]:
         "нк рф",
         "подпункт",
         "подп. ",
-    ]
+    ),
+)
+
+PENALTY = Topic(
+    name="неустойка",
+    aliases=("пени", "штраф"),
+    keywords=(
+        "неустойк",
+        "статья 330",
+        "ст. 330",
+        "статья 333 гк",
+        "ст. 333 гк",
+        "снижение неустойки",
+        "несоразмерн",
+    ),
+    # как подстроки «пени»/«штраф» ловят «степени», «ступени», «оштрафован»
+    patterns=(
+        r"\bпен(?:и|я|ю|ей|ям|ями|ях)\b",
+        r"\bштраф",
+    ),
+)
+
+JURISDICTION = Topic(
+    name="подсудность",
+    aliases=("подведомственность",),
+    keywords=(
+        "подсудност",
+        "подсуден",
+        "подсудно",
+        "договорная подсудность",
+        "по месту нахождения ответчика",
+        "по месту жительства ответчика",
+        "передать дело",
+        "ст. 28 гпк",
+        "ст. 32 гпк",
+        "ст. 33 гпк",
+        "ст. 35 апк",
+        "ст. 37 апк",
+        "ст. 39 апк",
+    ),
+)
 
-    result: list[str] = []
+default_registry = TopicRegistry([STATE_DUTY, PENALTY, JURISDICTION])
 
-    for frag in fragments:
-        text = frag.lower()
-        if any(kw in text for kw in keywords):
-            result.append(frag)
 
-    return result
+def filter_fragments_by_topic(
+    fragments: Iterable[str],
+    topic: str,
+) -> List[str]:
+    """
+    Фильтр фрагментов по теме через реестр тем (default_registry):
+    ищем по ключевым словам и шаблонам всех тем за один проход.
+    """
+    try:
+        return default_registry.filter(fragments, topic)
+    except KeyError:
+        # неизвестная тема - не режем ничего, пусть решает LLM
+        print(f"[WARN] Тема «{topic}» не зарегистрирована, фильтр пропущен")
+        return list(fragments)
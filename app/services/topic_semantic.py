@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from app.services.topic_filter import default_registry
+from config import settings
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+DEFAULT_PROTOTYPES_PATH = BASE_DIR / "data" / "topic_prototypes.npz"
+
+
+class TopicPrototypes:
+    """
+    Прототипы тем для семантического фильтра фрагментов.
+
+    Строятся офлайн скриптом scripts/build_topic_prototypes.py из размеченных
+    примеров: на тему - центроид и несколько прототипов (центры кластеров),
+    все векторы нормированы. Счёт фрагмента по теме - максимальная косинусная
+    близость его эмбеддинга к прототипам темы.
+
+    Формат .npz: "topics" - массив названий тем, "topic_<i>" - матрица
+    прототипов i-й темы (n x dim, float32).
+    """
+
+    def __init__(self, prototypes: Dict[str, np.ndarray]) -> None:
+        self._prototypes = prototypes
+
+    @classmethod
+    def load(cls, path: Path) -> "TopicPrototypes":
+        with np.load(Path(path), allow_pickle=False) as data:
+            names = [str(n) for n in data["topics"]]
+            return cls({
+                name: np.asarray(data[f"topic_{i}"], dtype=np.float32)
+                for i, name in enumerate(names)
+            })
+
+    @staticmethod
+    def save(path: Path, prototypes: Dict[str, np.ndarray]) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {
+            f"topic_{i}": _normalize_rows(np.asarray(matrix, dtype=np.float32))
+            for i, matrix in enumerate(prototypes.values())
+        }
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("wb") as f:
+            np.savez(f, topics=np.array(list(prototypes), dtype=str), **arrays)
+        os.replace(tmp, path)
+
+    @property
+    def topics(self) -> List[str]:
+        return list(self._prototypes)
+
+    def _resolve(self, topic: str) -> str | None:
+        if topic in self._prototypes:
+            return topic
+        resolved = default_registry.resolve(topic)
+        if resolved is not None and resolved.name in self._prototypes:
+            return resolved.name
+        return None
+
+    def has_topic(self, topic: str) -> bool:
+        return self._resolve(topic) is not None
+
+    def score(self, topic: str, embeddings: Sequence[Sequence[float]]) -> np.ndarray:
+        """
+        Счёт каждого эмбеддинга по теме: max cos к прототипам (одно матричное умножение).
+        """
+        name = self._resolve(topic)
+        if name is None:
+            raise KeyError(topic)
+        if not len(embeddings):
+            return np.zeros(0, dtype=np.float32)
+
+        queries = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        return (queries @ self._prototypes[name].T).max(axis=1)
+
+    def filter_indices(
+        self,
+        topic: str,
+        embeddings: Sequence[Sequence[float]],
+        keyword_hits: Sequence[bool],
+        threshold: float,
+        threshold_no_keyword: float,
+    ) -> List[int]:
+        """
+        Индексы фрагментов, которые проходят на анализ:
+          - с ключевым словом темы - если счёт не ниже threshold
+            (отсекает шум вроде «подпункт» / «НК РФ» не про тему);
+          - без ключевых слов - если счёт не ниже threshold_no_keyword
+            (ловит перефразированные формулировки; порог строже).
+        """
+        scores = self.score(topic, embeddings)
+        return [
+            i
+            for i, (score, hit) in enumerate(zip(scores, keyword_hits))
+            if score >= (threshold if hit else threshold_no_keyword)
+        ]
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+_prototypes: TopicPrototypes | None = None
+_loaded = False
+
+
+def get_topic_prototypes() -> TopicPrototypes | None:
+    """
+    Прототипы тем для семантического фильтра (загружаются один раз).
+    None - фильтр выключен в настройках или файл прототипов не построен.
+    """
+    global _prototypes, _loaded
+    if not settings.topic_semantic_filter:
+        return None
+    if not _loaded:
+        _loaded = True
+        path = Path(settings.topic_prototypes_path or DEFAULT_PROTOTYPES_PATH)
+        try:
+            _prototypes = TopicPrototypes.load(path)
+        except FileNotFoundError:
+            print(f"[WARN] Файл прототипов тем не найден ({path}), семантический фильтр выключен")
+        except Exception as e:
+            print(f"[WARN] Не удалось загрузить прототипы тем: {e}")
+    return _prototypes
@@ -5,8 +5,106 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class Settings(BaseSettings):
     bot_token: str | None = Field(default=None, alias="BOT_TOKEN")
 
+    # Режим получения апдейтов: "polling" | "webhook"
+    bot_mode: str = Field(default="polling", alias="BOT_MODE")
+    # Webhook: внешний адрес (за reverse proxy), путь, секрет и адрес, который слушает aiohttp
+    webhook_base_url: str | None = Field(default=None, alias="WEBHOOK_BASE_URL")  # https://bot.example.com
+    webhook_path: str = Field(default="/telegram/webhook", alias="WEBHOOK_PATH")
+    webhook_secret: str | None = Field(default=None, alias="WEBHOOK_SECRET")
+    webhook_host: str = Field(default="0.0.0.0", alias="WEBHOOK_HOST")
+    webhook_port: int = Field(default=8080, alias="WEBHOOK_PORT")
+    # при нескольких инстансах за балансировщиком снимать webhook при остановке одного нельзя
+    webhook_set_on_startup: bool = Field(default=True, alias="WEBHOOK_SET_ON_STARTUP")
+    webhook_delete_on_shutdown: bool = Field(default=False, alias="WEBHOOK_DELETE_ON_SHUTDOWN")
+
+    # Загрузки пользователей: файлы больше UPLOAD_MAX_MB отклоняются до скачивания,
+    # до UPLOAD_IN_MEMORY_MB скачиваются в память, крупнее - во временный файл на диске
+    upload_max_mb: float = Field(default=20.0, alias="UPLOAD_MAX_MB")
+    upload_in_memory_mb: float = Field(default=10.0, alias="UPLOAD_IN_MEMORY_MB")
+
     openai_api_key: str | None = Field(default=None, alias="OPENAI_API_KEY")
+
+    # OpenAI: общий пул HTTP-соединений и таймауты (секунды)
+    openai_max_connections: int = Field(default=100, alias="OPENAI_MAX_CONNECTIONS")
+    openai_max_keepalive: int = Field(default=20, alias="OPENAI_MAX_KEEPALIVE")
+    openai_connect_timeout: float = Field(default=10.0, alias="OPENAI_CONNECT_TIMEOUT")
+    openai_embedding_timeout: float = Field(default=30.0, alias="OPENAI_EMBEDDING_TIMEOUT")
+    openai_chat_timeout: float = Field(default=120.0, alias="OPENAI_CHAT_TIMEOUT")
+    openai_max_retries: int = Field(default=2, alias="OPENAI_MAX_RETRIES")
+    # Structured output: ответ модели ограничен JSON-схемой вердикта (strict)
+    openai_structured_output: bool = Field(default=True, alias="OPENAI_STRUCTURED_OUTPUT")
+    # Батчинг эмбеддингов: сколько строк и (примерно) токенов в одном запросе
+    openai_embedding_batch_size: int = Field(default=512, alias="OPENAI_EMBEDDING_BATCH_SIZE")
+    openai_embedding_batch_tokens: int = Field(default=250_000, alias="OPENAI_EMBEDDING_BATCH_TOKENS")
+
+    # Дисковый кеш эмбеддингов (SQLite), общий для бота и индексатора
+    embedding_cache_enabled: bool = Field(default=True, alias="EMBEDDING_CACHE_ENABLED")
+    embedding_cache_path: str | None = Field(default=None, alias="EMBEDDING_CACHE_PATH")
+    embedding_cache_max_entries: int = Field(default=500_000, alias="EMBEDDING_CACHE_MAX_ENTRIES")
+
+    # Кеш LLM-вердиктов (SQLite), сбрасывается при переиндексации
+    verdict_cache_enabled: bool = Field(default=True, alias="VERDICT_CACHE_ENABLED")
+    verdict_cache_path: str | None = Field(default=None, alias="VERDICT_CACHE_PATH")
+    verdict_cache_max_entries: int = Field(default=50_000, alias="VERDICT_CACHE_MAX_ENTRIES")
+    verdict_cache_ttl: float = Field(default=30 * 24 * 3600, alias="VERDICT_CACHE_TTL")  # сек
+
+    # Кеш готовых результатов по документам (file_unique_id / хеш содержимого)
+    result_cache_enabled: bool = Field(default=True, alias="RESULT_CACHE_ENABLED")
+    result_cache_path: str | None = Field(default=None, alias="RESULT_CACHE_PATH")
+    result_cache_max_entries: int = Field(default=10_000, alias="RESULT_CACHE_MAX_ENTRIES")
+    result_cache_ttl: float = Field(default=7 * 24 * 3600, alias="RESULT_CACHE_TTL")  # сек
+
     vector_store_url: str | None = Field(default=None, alias="VECTOR_STORE_URL")
+    # Векторное хранилище: "pinecone" | "local" (NumPy + memmap) | "dummy"
+    vector_store_backend: str = Field(default="pinecone", alias="VECTOR_STORE_BACKEND")
+    local_vector_store_dir: str | None = Field(default=None, alias="LOCAL_VECTOR_STORE_DIR")
+
+    # Гибридный поиск норм: векторы + локальный BM25, слияние через RRF
+    hybrid_search_enabled: bool = Field(default=True, alias="HYBRID_SEARCH_ENABLED")
+    lexical_index_path: str | None = Field(default=None, alias="LEXICAL_INDEX_PATH")
+    hybrid_candidates: int = Field(default=20, alias="HYBRID_CANDIDATES")  # кандидатов с каждой стороны
+    hybrid_rrf_k: int = Field(default=60, alias="HYBRID_RRF_K")
+
+    # Анализ документа: параллельность и бюджет на фрагменты
+    analysis_concurrency: int = Field(default=8, alias="ANALYSIS_CONCURRENCY")
+    analysis_max_fragments: int = Field(default=30, alias="ANALYSIS_MAX_FRAGMENTS")  # 0 - без лимита
+    analysis_time_budget: float = Field(default=240.0, alias="ANALYSIS_TIME_BUDGET")  # сек, 0 - без лимита
+    # Схлопывание почти одинаковых фрагментов (SimHash): анализ один раз на кластер
+    dedup_enabled: bool = Field(default=True, alias="DEDUP_ENABLED")
+    dedup_max_distance: int = Field(default=10, alias="DEDUP_MAX_DISTANCE")  # бит из 64
+    # Режим LLM-анализа: "single" - запрос на фрагмент, "batch" - несколько фрагментов в запросе
+    analysis_mode: str = Field(default="single", alias="ANALYSIS_MODE")
+    analysis_batch_size: int = Field(default=6, alias="ANALYSIS_BATCH_SIZE")          # фрагментов в пакете
+    analysis_batch_tokens: int = Field(default=8_000, alias="ANALYSIS_BATCH_TOKENS")  # оценка токенов промпта
+
+    # Очередь анализов: пул воркеров и лимиты на пользователя (чат)
+    job_workers: int = Field(default=4, alias="JOB_WORKERS")                            # анализов одновременно
+    job_per_user_concurrency: int = Field(default=1, alias="JOB_PER_USER_CONCURRENCY")  # в работе на чат
+    job_per_user_queue: int = Field(default=3, alias="JOB_PER_USER_QUEUE")              # в работе + в очереди на чат
+    job_max_queue: int = Field(default=100, alias="JOB_MAX_QUEUE")                      # всего в очереди
+    job_drain_timeout: float = Field(default=300.0, alias="JOB_DRAIN_TIMEOUT")          # сек на доработку при остановке
+
+    # Поэтапная выдача: статус с прогрессом + каждый фрагмент отдельным сообщением по готовности
+    progressive_delivery: bool = Field(default=False, alias="PROGRESSIVE_DELIVERY")
+    progress_edit_interval: float = Field(default=1.5, alias="PROGRESS_EDIT_INTERVAL")  # сек между правками статуса
+
+    # Семантический фильтр по теме: близость эмбеддинга фрагмента к прототипам темы
+    topic_semantic_filter: bool = Field(default=False, alias="TOPIC_SEMANTIC_FILTER")
+    topic_prototypes_path: str | None = Field(default=None, alias="TOPIC_PROTOTYPES_PATH")
+    # порог для фрагментов с ключевыми словами темы и (строже) - без них
+    topic_semantic_threshold: float = Field(default=0.30, alias="TOPIC_SEMANTIC_THRESHOLD")
+    topic_semantic_threshold_no_keyword: float = Field(
+        default=0.45, alias="TOPIC_SEMANTIC_THRESHOLD_NO_KEYWORD"
+    )
+
+    # Извлечение текста пользовательских документов (пул процессов)
+    extraction_workers: int = Field(default=2, alias="EXTRACTION_WORKERS")
+    extraction_pages_per_task: int = Field(default=20, alias="EXTRACTION_PAGES_PER_TASK")
+    extraction_cpu_budget: float = Field(default=60.0, alias="EXTRACTION_CPU_BUDGET")  # сек CPU на документ
+    extraction_timeout: float = Field(default=180.0, alias="EXTRACTION_TIMEOUT")  # сек на документ
+    # если воркер завис внутри одной страницы и не уложился в таймаут + запас - пул перезапускается
+    extraction_kill_grace: float = Field(default=10.0, alias="EXTRACTION_KILL_GRACE")
+    extraction_docx_max_mb: float = Field(default=100.0, alias="EXTRACTION_DOCX_MAX_MB")  # распакованный DOCX
 
     debug: bool = Field(default=False, alias="DEBUG")
 
@@ -15,6 +113,7 @@ class Settings(BaseSettings):
     pinecone_index_name: str = Field(default="lexy-legal-norms", alias="PINECONE_INDEX_NAME")
     pinecone_cloud: str = Field(default="aws", alias="PINECONE_CLOUD")
     pinecone_region: str = Field(default="us-east-1", alias="PINECONE_REGION")
+    pinecone_query_concurrency: int = Field(default=8, alias="PINECONE_QUERY_CONCURRENCY")
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Iterator, List, Tuple
 
 
 TELEGRAM_MAX_MESSAGE_LEN = 4096
@@ -18,28 +18,50 @@ def split_text_for_telegram(
     if len(text) <= max_len:
         return [text]
 
-    chunks: list[str] = []
-    remaining = text
+    return [text[start:end] for start, end in iter_telegram_spans(text, max_len)]
 
-    while len(remaining) > max_len:
+
+def iter_telegram_spans(
+    text: str,
+    max_len: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Tuple[int, int]]:
+    """
+    Границы частей (start, end) для split_text_for_telegram.
+    Поиск разделителей идёт по индексам в исходной строке, без срезов остатка,
+    поэтому время линейно от длины текста.
+    """
+    n = len(text)
+    if n <= max_len:
+        if n:
+            yield 0, n
+        return
+
+    start = 0
+    while n - start > max_len:
+        limit = start + max_len
         # сначала пробуем резать по двойному \n\n
-        split_pos = remaining.rfind("\n\n", 0, max_len)
+        split_pos = text.rfind("\n\n", start, limit)
         if split_pos == -1:
             # если нет - пробуем по одиночному \n
-            split_pos = remaining.rfind("\n", 0, max_len)
+            split_pos = text.rfind("\n", start, limit)
         if split_pos == -1:
             # если и тут нет - по пробелу
-            split_pos = remaining.rfind(" ", 0, max_len)
+            split_pos = text.rfind(" ", start, limit)
         if split_pos == -1:
             # вообще без разделителей - рубим жестко
-            split_pos = max_len
+            split_pos = limit
 
-        chunk = remaining[:split_pos].strip()
-        if chunk:
-            chunks.append(chunk)
-        remaining = remaining[split_pos:].lstrip()
+        chunk_start, chunk_end = start, split_pos
+        while chunk_start < chunk_end and text[chunk_start].isspace():
+            chunk_start += 1
+        while chunk_end > chunk_start and text[chunk_end - 1].isspace():
+            chunk_end -= 1
+        if chunk_start < chunk_end:
+            yield chunk_start, chunk_end
 
-    if remaining:
-        chunks.append(remaining)
+        start = split_pos
+        while start < n and text[start].isspace():
+            start += 1
 
-    return chunks
+    if start < n:
+        yield start, n
@@ -1,14 +1,119 @@
 import asyncio
 
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
 from app.bot_factory import create_bot, create_dispatcher
+from app.integrations.lexical_index import get_lexical_index
+from app.integrations.openai_client import close_client
+from app.integrations.vector_store import get_vector_store
+from app.services.extraction_pool import shutdown_extraction_pool
+from app.services.job_queue import get_job_scheduler
+from config import settings
 
 
-async def main() -> None:
-    bot = create_bot()
+async def on_startup(bot: Bot, dispatcher: Dispatcher) -> None:
+    # векторное хранилище и BM25-индекс поднимаем заранее, а не в первом запросе
+    # пользователя (разбор JSON индекса - в потоке, event loop не блокируется)
+    get_vector_store()
+    await asyncio.to_thread(get_lexical_index)
+
+    await get_job_scheduler().start()
+
+    if is_webhook_mode() and settings.webhook_set_on_startup:
+        await bot.set_webhook(
+            get_webhook_url(),
+            secret_token=settings.webhook_secret,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+        print(f"[INFO] Webhook установлен: {get_webhook_url()}")
+
+
+async def on_shutdown(bot: Bot) -> None:
+    if is_webhook_mode() and settings.webhook_delete_on_shutdown:
+        await bot.delete_webhook()
+
+    # сначала даём доработать уже принятым анализам, потом закрываем ресурсы
+    await get_job_scheduler().stop(drain_timeout=settings.job_drain_timeout)
+    await close_client()
+    shutdown_extraction_pool()
+
+
+def is_webhook_mode() -> bool:
+    return settings.bot_mode.lower().strip() == "webhook"
+
+
+def get_webhook_url() -> str:
+    return settings.webhook_base_url.rstrip("/") + settings.webhook_path
+
+
+def create_dispatcher_with_lifecycle() -> Dispatcher:
     dp = create_dispatcher()
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+async def run_polling() -> None:
+    bot = create_bot()
+    dp = create_dispatcher_with_lifecycle()
 
+    # если раньше бот работал через webhook - getUpdates без этого не работает
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
 
+def run_webhook() -> None:
+    """
+    Webhook-режим: aiohttp-приложение за reverse proxy.
+    Telegram присылает секрет в заголовке X-Telegram-Bot-Api-Secret-Token,
+    запросы без него отклоняются. SIGTERM/SIGINT обрабатывает aiohttp:
+    сервер перестаёт принимать апдейты, on_shutdown дожидается анализов.
+    """
+    if not settings.webhook_base_url:
+        raise RuntimeError("WEBHOOK_BASE_URL is not set in environment/.env")
+    if not settings.webhook_secret:
+        raise RuntimeError("WEBHOOK_SECRET is not set in environment/.env")
+
+    bot = create_bot()
+    dp = create_dispatcher_with_lifecycle()
+
+    app = web.Application()
+    # порядок важен: обработчики on_shutdown идут в порядке регистрации, и
+    # остановка диспетчера (дренаж анализов) должна пройти раньше, чем
+    # SimpleRequestHandler закроет HTTP-сессию бота
+    setup_application(app, dp, bot=bot)
+    # handle_in_background: Telegram получает 200 сразу, а апдейт обрабатывается
+    # отдельной задачей - загрузка ждёт анализ минутами, и держать всё это время
+    # HTTP-запрос webhook нельзя (таймаут, лимит соединений, задержка чужих апдейтов)
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=settings.webhook_secret,
+    ).register(app, path=settings.webhook_path)
+    app.router.add_get("/healthz", healthz)
+
+    web.run_app(app, host=settings.webhook_host, port=settings.webhook_port)
+
+
+async def healthz(request: web.Request) -> web.Response:
+    # для балансировщика: принимает ли инстанс файлы и насколько он загружен;
+    # до старта и при остановке (дренаж) - 503, чтобы новые апдейты шли на другие инстансы
+    scheduler = get_job_scheduler()
+    return web.json_response(
+        {
+            "status": "ok" if scheduler.accepting else "not_ready",
+            "in_flight": scheduler.in_flight,
+            "queued": scheduler.queued,
+        },
+        status=200 if scheduler.accepting else 503,
+    )
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    if is_webhook_mode():
+        run_webhook()
+    else:
+        asyncio.run(run_polling())
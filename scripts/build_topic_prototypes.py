@@ -0,0 +1,141 @@
+import argparse
+import asyncio
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.integrations.openai_client import get_embeddings
+from app.services.topic_filter import default_registry
+from app.services.topic_semantic import DEFAULT_PROTOTYPES_PATH, TopicPrototypes
+
+DEFAULT_EXAMPLES_PATH = Path("data/topic_examples.jsonl")
+
+PROTOTYPES_PER_TOPIC = 4   # кластеров на тему (плюс общий центроид)
+KMEANS_ITERATIONS = 20
+
+
+def load_examples(path: Path) -> Dict[str, List[str]]:
+    """
+    Размеченные примеры: JSONL, по строке {"text": "...", "topic": "госпошлина"}.
+    Пустая тема ("" / null) - отрицательный пример (фрагмент не по теме),
+    такие примеры нужны только для подсказки порога.
+    """
+    examples: Dict[str, List[str]] = {}
+    with path.open(encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            text = (item.get("text") or "").strip()
+            if not text:
+                print(f"[WARN] Строка {line_no}: пустой текст, пропускаем")
+                continue
+
+            topic = (item.get("topic") or "").strip()
+            if topic:
+                resolved = default_registry.resolve(topic)
+                topic = resolved.name if resolved is not None else topic
+            examples.setdefault(topic, []).append(text)
+    return examples
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def build_prototypes(vectors: np.ndarray, k: int, seed: int = 0) -> np.ndarray:
+    """
+    Центроид темы + k центров сферического k-means (косинусная близость).
+    Несколько прототипов покрывают разные формулировки темы лучше одного центроида.
+    """
+    vectors = _normalize(vectors.astype(np.float32))
+    centroid = _normalize(vectors.mean(axis=0, keepdims=True))
+
+    k = min(k, len(vectors))
+    if k <= 1:
+        return centroid
+
+    rng = np.random.default_rng(seed)
+    centers = vectors[rng.choice(len(vectors), size=k, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assign = (vectors @ centers.T).argmax(axis=1)
+        for j in range(k):
+            members = vectors[assign == j]
+            if len(members):
+                centers[j] = members.mean(axis=0)
+        centers = _normalize(centers)
+
+    return np.vstack([centroid, centers])
+
+
+def print_threshold_hints(
+    prototypes: TopicPrototypes,
+    vectors: Dict[str, np.ndarray],
+) -> None:
+    negatives = vectors.get("")
+    for topic in prototypes.topics:
+        pos = prototypes.score(topic, vectors[topic])
+        line = (
+            f"{topic}: примеров {len(pos)}, "
+            f"счёт положительных: min {pos.min():.3f}, p10 {np.percentile(pos, 10):.3f}"
+        )
+        if negatives is not None and len(negatives):
+            neg = prototypes.score(topic, negatives)
+            line += f"; отрицательных: p90 {np.percentile(neg, 90):.3f}, max {neg.max():.3f}"
+        print(line)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Построение прототипов тем для семантического фильтра")
+    parser.add_argument(
+        "--examples",
+        type=Path,
+        default=DEFAULT_EXAMPLES_PATH,
+        help="JSONL с размеченными примерами фрагментов",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=DEFAULT_PROTOTYPES_PATH,
+        help="куда сохранить прототипы (.npz)",
+    )
+    parser.add_argument(
+        "--prototypes",
+        type=int,
+        default=PROTOTYPES_PER_TOPIC,
+        help="сколько прототипов (кластеров) строить на тему",
+    )
+    return parser.parse_args(argv)
+
+
+async def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+
+    examples = load_examples(args.examples)
+    topics = [t for t in examples if t]
+    if not topics:
+        print("Нет размеченных примеров ни для одной темы.")
+        return
+
+    vectors: Dict[str, np.ndarray] = {}
+    for topic, texts in examples.items():
+        vectors[topic] = np.asarray(await get_embeddings(texts), dtype=np.float32)
+
+    prototypes = {
+        topic: build_prototypes(vectors[topic], k=args.prototypes)
+        for topic in topics
+    }
+    TopicPrototypes.save(args.output, prototypes)
+    print(f"Прототипы сохранены: {args.output}")
+
+    # подсказка для TOPIC_SEMANTIC_THRESHOLD*: порог между отрицательными и положительными
+    print_threshold_hints(TopicPrototypes(prototypes), vectors)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
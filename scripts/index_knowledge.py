@@ -1,44 +1,76 @@
+import argparse
 import asyncio
 import hashlib
+import math
+import os
 import re
-import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 
 from tqdm import tqdm as tqdm_sync
 
-from app.services.text_extractor import extract_text
-from app.integrations.openai_client import get_embedding
-from app.integrations.pinecone_client import get_pinecone_index
+from app.services.chunker import chunk_text, make_excerpt
+from app.services.text_extractor import extract_knowledge_pdfs_parallel, extract_text
+from app.integrations.openai_client import get_embeddings
+from app.integrations.embedding_cache import get_embedding_cache_stats
+from app.integrations.verdict_cache import invalidate_verdict_cache
+from app.services.result_cache import invalidate_result_cache
+from app.integrations.vector_store import get_local_store_dir
+from app.integrations.lexical_index import LexicalIndex, get_lexical_index_path
+from config import settings
+from scripts.index_manifest import FileEntry, Manifest, chunk_sha256, file_sha256
 
 DATA_DIR = Path("data/knowledge")
+MANIFEST_DIR = Path("data")
 
 CHUNK_SIZE = 1800
+CHUNK_OVERLAP = 200       # перекрытие соседних чанков (символов, целыми предложениями/пунктами)
+LEGACY_CHUNK_SIZE = 1800  # нарезка старого индексатора (для удаления его векторов)
+SUMMARY_CHARS = 600       # выдержка из самого чанка в metadata["summary"]
 BATCH_SIZE = 50
 MAX_RETRIES = 5
 BASE_DELAY = 2.0
-CONCURRENCY = 10          # одновременно 10 запросов к OpenAI
-EMBED_TIMEOUT = 60        # таймаут на один запрос эмбеддинга (секунд)
+CONCURRENCY = 4           # одновременно 4 батчевых запроса к OpenAI
+EMBED_BATCH_SIZE = 256    # чанков в одном запросе эмбеддингов
+EMBED_TIMEOUT = 120       # таймаут на один батчевый запрос эмбеддингов (секунд)
+UPSERT_CONCURRENCY = 4    # одновременно 4 upsert-запроса к хранилищу
+QUEUE_SIZE = 1024         # ёмкость очередей между стадиями (чанков/векторов)
+BATCH_LINGER = 1.0        # сколько ждать добора батча, прежде чем отправить неполный (секунд)
+
+_DONE = None              # маркер конца потока в очередях
 
 
 @dataclass
 class ChunkItem:
-    file_path: Path
+    rel_path: str
     chunk_index: int
     text: str
     metadata_base: dict
 
 
-def split_into_chunks(text: str, max_chars: int = CHUNK_SIZE) -> List[str]:
-    text = text.strip()
-    if len(text) <= max_chars:
-        return [text] if text else []
-
-    return [
-        text[i:i + max_chars].strip()
-        for i in range(0, len(text), max_chars)
-    ]
+@dataclass
+class FilePlan:
+    """
+    Что нужно сделать с одним файлом базы знаний при индексации.
+    """
+    rel_path: str
+    sha256: str
+    chunk_hashes: List[str] = field(default_factory=list)
+    ids: List[str] = field(default_factory=list)
+    # id чанков, ушедших на эмбеддинг (сами тексты в плане не держим)
+    pending_ids: List[str] = field(default_factory=list)
+    to_delete: List[str] = field(default_factory=list)
+    is_new: bool = False
+
+
+def split_into_chunks(
+    text: str,
+    max_chars: int = CHUNK_SIZE,
+    overlap: int = CHUNK_OVERLAP,
+) -> List[str]:
+    # режем по абзацам, пунктам ("п. 12") и предложениям, а не каждые N символов
+    return chunk_text(text, max_chars=max_chars, overlap=overlap)
 
 
 def build_metadata(file_path: Path) -> dict:
@@ -65,136 +97,564 @@ def build_metadata(file_path: Path) -> dict:
     }
 
 
-def make_vector_id(file_path: Path, chunk_idx: int) -> str:
-    digest = hashlib.md5(file_path.stem.encode("utf-8")).hexdigest()[:12]
+def make_vector_id(rel_path: str, chunk_idx: int) -> str:
+    # от пути внутри базы знаний, а не от имени: a/ГК.pdf и b/ГК.pdf - разные файлы
+    digest = hashlib.md5(rel_path.encode("utf-8")).hexdigest()[:12]
     return f"{digest}_{chunk_idx}"
 
 
-async def get_embedding_with_retry(text: str) -> Optional[List[float]]:
+def legacy_vector_ids(file_path: Path, text: str) -> List[str]:
+    """
+    id, под которыми этот файл загружал старый индексатор (до манифеста):
+    md5 от имени файла и нарезка текста кусками по LEGACY_CHUNK_SIZE символов.
+    Их удаляем при первой индексации без манифеста, иначе старые векторы
+    (с выдержкой из начала файла вместо выдержки чанка) остаются в хранилище
+    рядом с новыми и дублируются в выдаче.
+    """
+    text = text.strip()
+    count = math.ceil(len(text) / LEGACY_CHUNK_SIZE) if text else 0
+    digest = hashlib.md5(file_path.stem.encode("utf-8")).hexdigest()[:12]
+    return [f"{digest}_{i}" for i in range(count)]
+
+
+def has_current_ids(rel_path: str, entry: FileEntry) -> bool:
+    """
+    id векторов файла в манифесте построены по текущей схеме make_vector_id.
+    Иначе файл переиндексируется, а векторы со старыми id удаляются.
+    """
+    return all(vid == make_vector_id(rel_path, i) for i, vid in enumerate(entry.ids))
+
+
+async def get_embeddings_with_retry(texts: List[str]) -> Optional[List[List[float]]]:
     for attempt in range(MAX_RETRIES):
         try:
-            # таймаут на запрос к OpenAI
+            # таймаут на батчевый запрос к OpenAI
             return await asyncio.wait_for(
-                get_embedding(text),
+                get_embeddings(texts),
                 timeout=EMBED_TIMEOUT
             )
         except asyncio.TimeoutError:
             delay = BASE_DELAY * (attempt + 1)
-            print(f"[WARN] get_embedding timeout, retry через {delay}s")
+            print(f"[WARN] get_embeddings timeout, retry через {delay}s")
             await asyncio.sleep(delay)
         except Exception as e:
             delay = BASE_DELAY * (attempt + 1)
-            print(f"[WARN] get_embedding ошибка: {e}, retry через {delay}s")
+            print(f"[WARN] get_embeddings ошибка: {e}, retry через {delay}s")
             await asyncio.sleep(delay)
 
-    print("[ERROR] эмбеддинг не получен, пропуск чанка.")
+    print(f"[ERROR] эмбеддинги не получены, пропуск {len(texts)} чанков.")
     return None
 
 
-def upsert_with_retry(index, batch):
+async def upsert_with_retry(index, batch) -> bool:
     for attempt in range(MAX_RETRIES):
         try:
-            index.upsert(vectors=batch)
-            return
+            # SDK Pinecone синхронный - уводим вызов в поток
+            await asyncio.to_thread(index.upsert, vectors=batch)
+            return True
         except Exception as e:
             delay = BASE_DELAY * (attempt + 1)
             print(f"[WARN] Pinecone upsert ошибка: {e}, retry через {delay}s")
-            time.sleep(delay)
+            await asyncio.sleep(delay)
 
     print(f"[ERROR] batch ({len(batch)}) пропущен.")
+    return False
 
 
-async def process_chunk_item(item: ChunkItem):
-    emb = await get_embedding_with_retry(item.text)
-    if emb is None:
-        return None
+async def delete_with_retry(index, ids: List[str]) -> None:
+    for attempt in range(MAX_RETRIES):
+        try:
+            await asyncio.to_thread(index.delete, ids=ids)
+            return
+        except Exception as e:
+            delay = BASE_DELAY * (attempt + 1)
+            print(f"[WARN] Pinecone delete ошибка: {e}, retry через {delay}s")
+            await asyncio.sleep(delay)
 
-    return {
-        "id": make_vector_id(item.file_path, item.chunk_index),
-        "values": emb,
-        "metadata": {
-            **item.metadata_base,
-            "chunk_index": item.chunk_index,
+    print(f"[ERROR] удаление ({len(ids)}) векторов пропущено.")
+
+
+async def process_chunk_batch(items: List[ChunkItem]) -> List[dict]:
+    embeddings = await get_embeddings_with_retry([item.text for item in items])
+    if embeddings is None:
+        return []
+
+    return [
+        {
+            "id": make_vector_id(item.rel_path, item.chunk_index),
+            "values": emb,
+            "metadata": {
+                **item.metadata_base,
+                "chunk_index": item.chunk_index,
+            }
         }
-    }
+        for item, emb in zip(items, embeddings)
+    ]
 
 
-async def main():
-    # -------------------------------
-    # 1) ЧТЕНИЕ PDF + СПЛИТ
-    # -------------------------------
-    pdf_files = [p for p in DATA_DIR.rglob("*.pdf")]
+class PineconeSink:
+    """
+    Приёмник векторов: индекс Pinecone, запросы идут асинхронно.
+    """
 
-    print(f"Найдено файлов: {len(pdf_files)}")
+    def __init__(self) -> None:
+        from app.integrations.pinecone_client import get_pinecone_index
+
+        print("Подключаюсь к Pinecone...")
+        self.index = get_pinecone_index()
+        print("Готово.")
+
+    async def upsert(self, batch: List[dict]) -> bool:
+        return await upsert_with_retry(self.index, batch)
+
+    async def delete(self, ids: List[str]) -> None:
+        for i in range(0, len(ids), 1000):
+            await delete_with_retry(self.index, ids[i:i + 1000])
 
-    all_chunks: List[ChunkItem] = []
+    async def close(self) -> None:
+        pass
 
-    for file_path in tqdm_sync(pdf_files, desc="Чтение PDF", unit="file"):
-        text = extract_text(file_path).strip()
-        if not text:
+
+class LocalStoreSink:
+    """
+    Приёмник векторов: локальное NumPy-хранилище.
+    Хранилище целиком живёт в памяти, на диск пишется один раз в close().
+    """
+
+    def __init__(self) -> None:
+        from app.integrations.local_vector_store import NumpyVectorStore
+
+        self._store_cls = NumpyVectorStore
+        self.store_dir = get_local_store_dir()
+        self.records = NumpyVectorStore.load_records(self.store_dir)
+        self.dirty = False
+
+    async def upsert(self, batch: List[dict]) -> bool:
+        for r in batch:
+            self.records[r["id"]] = (r["values"], r["metadata"])
+        self.dirty = True
+        return True
+
+    async def delete(self, ids: List[str]) -> None:
+        for vector_id in ids:
+            self.records.pop(vector_id, None)
+        self.dirty = self.dirty or bool(ids)
+
+    async def close(self) -> None:
+        if not self.dirty:
+            return
+        print(f"Сохраняю локальное хранилище в {self.store_dir}...")
+        await asyncio.to_thread(
+            self._store_cls.save,
+            self.store_dir,
+            list(self.records),
+            [vec for vec, _ in self.records.values()],
+            [md for _, md in self.records.values()],
+        )
+
+
+def get_manifest_path() -> Path:
+    # у каждого бэкенда своё содержимое, поэтому и манифест свой
+    backend = settings.vector_store_backend.lower().strip()
+    return MANIFEST_DIR / f"index_manifest.{backend}.json"
+
+
+def plan_file(
+    file_path: Path,
+    text: str,
+    rel_path: str,
+    sha256: str,
+    entry: Optional[FileEntry],
+    incremental: bool,
+    lexical: Optional[LexicalIndex] = None,
+    legacy: bool = False,
+) -> Tuple[FilePlan, List[ChunkItem]]:
+    """
+    Режет текст файла, сравнивает чанки с манифестом.
+    Возвращает план и чанки к эмбеддингу:
+    - новые и изменившиеся чанки (в полном режиме - все);
+    - в plan.to_delete - id векторов, которых больше нет (файл стал короче).
+    Если передан lexical, все чанки файла сразу попадают в BM25-индекс
+    (это локально и дёшево, эмбеддинги для этого не нужны).
+    legacy - манифеста ещё нет: к удалению добавляются id старого индексатора.
+    """
+    plan = FilePlan(rel_path=rel_path, sha256=sha256, is_new=entry is None)
+    to_embed: List[ChunkItem] = []
+
+    text = text.strip()
+    chunks = split_into_chunks(text) if text else []
+    meta_base = build_metadata(file_path)
+
+    old_chunks = entry.chunks if entry else []
+    old_ids = entry.ids if entry else []
+
+    for i, ch in enumerate(chunks):
+        # у каждого чанка своя выдержка, а не начало всего файла
+        meta = {**meta_base, "summary": make_excerpt(ch, SUMMARY_CHARS)}
+        item = ChunkItem(rel_path=rel_path, chunk_index=i, text=ch, metadata_base=meta)
+        vector_id = make_vector_id(rel_path, i)
+        chunk_hash = chunk_sha256(ch, meta)
+
+        plan.chunk_hashes.append(chunk_hash)
+        plan.ids.append(vector_id)
+        if lexical is not None:
+            lexical.add(vector_id, ch, meta)
+
+        unchanged = (
+            incremental
+            and i < len(old_chunks)
+            and old_chunks[i] == chunk_hash
+            and old_ids[i] == vector_id
+        )
+        if not unchanged:
+            plan.pending_ids.append(vector_id)
+            to_embed.append(item)
+
+    new_ids = set(plan.ids)
+    plan.to_delete = [vid for vid in old_ids if vid not in new_ids]
+    if legacy:
+        plan.to_delete += [vid for vid in legacy_vector_ids(file_path, text) if vid not in new_ids]
+    if lexical is not None:
+        for vid in plan.to_delete:
+            lexical.remove(vid)
+        lexical.files[rel_path] = sha256
+    return plan, to_embed
+
+
+async def iter_file_plans(
+    pdf_files: List[Path],
+    manifest: Manifest,
+    incremental: bool,
+    counters: Dict[str, int],
+    workers: int = 1,
+    pages_per_task: int = 0,
+    lexical: Optional[LexicalIndex] = None,
+    legacy: bool = False,
+) -> AsyncIterator[Tuple[FilePlan, List[ChunkItem]]]:
+    """
+    Стадия 1: хеш файла, извлечение текста, нарезка, сравнение с манифестом.
+    При workers > 1 PDF читаются в пуле процессов (и отдаются по готовности),
+    иначе - по одному в потоке. Event loop остаётся свободным для сетевых стадий.
+    """
+    candidates: Dict[Path, Tuple[str, str, Optional[FileEntry]]] = {}
+
+    for file_path in pdf_files:
+        rel_path = file_path.relative_to(DATA_DIR).as_posix()
+
+        sha256 = await asyncio.to_thread(file_sha256, file_path)
+        entry = manifest.files.get(rel_path)
+
+        # файл не менялся и все его чанки в индексе (и в BM25) - даже не читаем
+        if (
+            incremental
+            and entry
+            and entry.sha256 == sha256
+            and None not in entry.chunks
+            and has_current_ids(rel_path, entry)
+            and (lexical is None or lexical.files.get(rel_path) == sha256)
+        ):
+            counters["unchanged"] += 1
             continue
 
-        chunks = split_into_chunks(text)
-        meta = build_metadata(file_path)
-        meta["summary"] = text[:700]
-
-        for i, ch in enumerate(chunks):
-            all_chunks.append(
-                ChunkItem(
-                    file_path=file_path,
-                    chunk_index=i,
-                    text=ch,
-                    metadata_base=meta
-                )
-            )
+        candidates[file_path] = (rel_path, sha256, entry)
 
-    print(f"Всего чанков: {len(all_chunks)}")
+    if workers > 1:
+        texts = extract_knowledge_pdfs_parallel(
+            list(candidates),
+            max_workers=workers,
+            pages_per_task=pages_per_task,
+        )
+    else:
+        texts = _extract_sequential(list(candidates))
+
+    async for file_path, text in texts:
+        rel_path, sha256, entry = candidates[file_path]
+        yield plan_file(file_path, text, rel_path, sha256, entry, incremental, lexical, legacy)
+
+
+async def _extract_sequential(paths: List[Path]) -> AsyncIterator[Tuple[Path, str]]:
+    for file_path in paths:
+        yield file_path, await asyncio.to_thread(extract_text, file_path)
+
+
+async def produce_chunks(
+    file_plans: AsyncIterator[Tuple[FilePlan, List[ChunkItem]]],
+    plans: List[FilePlan],
+    chunk_queue: asyncio.Queue,
+    pbar,
+) -> None:
+    try:
+        async for plan, items in file_plans:
+            plans.append(plan)
+            pbar.total = (pbar.total or 0) + len(items)
+            pbar.refresh()
+            for item in items:
+                # очередь ограничена - если эмбеддинги не успевают, чтение PDF ждёт
+                await chunk_queue.put(item)
+    finally:
+        await chunk_queue.put(_DONE)
+
+
+async def batch_chunks(
+    chunk_queue: asyncio.Queue,
+    batch_queue: asyncio.Queue,
+    workers: int,
+) -> None:
+    """
+    Стадия 2: собирает чанки в батчи по EMBED_BATCH_SIZE.
+    Неполный батч уходит, если новых чанков нет дольше BATCH_LINGER.
+    """
+    batch: List[ChunkItem] = []
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(chunk_queue.get(), timeout=BATCH_LINGER)
+            except asyncio.TimeoutError:
+                if batch:
+                    await batch_queue.put(batch)
+                    batch = []
+                continue
+
+            if item is _DONE:
+                break
+            batch.append(item)
+            if len(batch) >= EMBED_BATCH_SIZE:
+                await batch_queue.put(batch)
+                batch = []
+
+        if batch:
+            await batch_queue.put(batch)
+    finally:
+        for _ in range(workers):
+            await batch_queue.put(_DONE)
+
+
+async def embed_worker(
+    batch_queue: asyncio.Queue,
+    record_queue: asyncio.Queue,
+    pbar,
+) -> None:
+    """
+    Стадия 3: постоянный воркер эмбеддингов - берёт следующий батч,
+    как только освободился (без ожидания «волны» соседей).
+    """
+    while True:
+        items = await batch_queue.get()
+        if items is _DONE:
+            return
+        for record in await process_chunk_batch(items):
+            await record_queue.put(record)
+        pbar.update(len(items))
+
+
+async def upsert_worker(
+    record_queue: asyncio.Queue,
+    sink,
+    done_ids: Set[str],
+) -> None:
+    """
+    Стадия 4: пачки по BATCH_SIZE векторов асинхронно уходят в хранилище.
+    """
+    batch: List[dict] = []
+    finished = False
+    while not finished:
+        record = await record_queue.get()
+        if record is _DONE:
+            finished = True
+        else:
+            batch.append(record)
+
+        if batch and (finished or len(batch) >= BATCH_SIZE):
+            if await sink.upsert(batch):
+                done_ids.update(r["id"] for r in batch)
+            batch = []
+
+
+def print_plan(
+    plans: List[FilePlan],
+    removed: Dict[str, FileEntry],
+    unchanged: int,
+) -> None:
+    print("Изменения в базе знаний:")
+    for plan in plans:
+        if not plan.pending_ids and not plan.to_delete:
+            continue
+        mark = "+" if plan.is_new else "~"
+        print(
+            f"  {mark} {plan.rel_path}: чанков {len(plan.ids)}, "
+            f"к эмбеддингу {len(plan.pending_ids)}, к удалению {len(plan.to_delete)}"
+        )
+    for rel_path, entry in sorted(removed.items()):
+        print(f"  - {rel_path}: удалить {len(entry.ids)} векторов")
+
+    total_embed = sum(len(p.pending_ids) for p in plans)
+    total_delete = sum(len(p.to_delete) for p in plans) + sum(len(e.ids) for e in removed.values())
+    print(
+        f"Итого: без изменений файлов {unchanged}, "
+        f"чанков к эмбеддингу {total_embed}, векторов к удалению {total_delete}"
+    )
 
-    # -------------------------------
-    # 2) ПАРАЛЛЕЛЬНО СЧИТАЕМ ЭМБЕДДИНГИ (БАТЧАМИ)
-    # -------------------------------
-    print("Получаю эмбеддинги...")
 
-    results = []
-    pbar = tqdm_sync(
-        total=len(all_chunks),
-        desc="Эмбеддинги",
-        unit="chunk"
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Индексация базы знаний")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="эмбеддить только новые/изменившиеся чанки (по манифесту)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="только показать, что изменится, ничего не загружая",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="сколько процессов читают PDF параллельно (0 - по числу ядер)",
     )
+    parser.add_argument(
+        "--pages-per-task",
+        type=int,
+        default=0,
+        help="резать PDF длиннее N страниц на части между процессами (0 - не резать)",
+    )
+    return parser.parse_args(argv)
 
-    # обрабатываем по CONCURRENCY чанков за раз
-    for i in range(0, len(all_chunks), CONCURRENCY):
-        batch_items = all_chunks[i:i + CONCURRENCY]
 
-        # запускаем задачи на текущий батч
-        tasks = [process_chunk_item(item) for item in batch_items]
-        batch_results = await asyncio.gather(*tasks)
+async def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    # dry-run без инкрементального режима бессмысленен: показали бы "всё заново"
+    incremental = args.incremental or args.dry_run
 
-        for res in batch_results:
-            if res is not None:
-                results.append(res)
+    manifest_path = get_manifest_path()
+    manifest = Manifest.load(manifest_path)
+    # индекс строил старый индексатор (без манифеста) - его векторы удаляем по старым id
+    legacy = not manifest_path.exists()
+    if legacy:
+        print("Манифест не найден: векторы со старыми id (по имени файла) будут удалены")
 
-        # обновляем прогресс на количество обработанных чанков
-        pbar.update(len(batch_items))
+    pdf_files = [p for p in DATA_DIR.rglob("*.pdf")]
+    print(f"Найдено файлов: {len(pdf_files)}")
 
+    seen = {p.relative_to(DATA_DIR).as_posix() for p in pdf_files}
+    removed = {rel: e for rel, e in manifest.files.items() if rel not in seen}
+
+    # BM25-индекс по тем же чанкам (при dry-run не трогаем)
+    lexical: Optional[LexicalIndex] = None
+    lexical_path = get_lexical_index_path()
+    if not args.dry_run:
+        try:
+            lexical = LexicalIndex.load(lexical_path) if incremental else LexicalIndex()
+        except FileNotFoundError:
+            lexical = LexicalIndex()
+
+    counters = {"unchanged": 0}
+    plans: List[FilePlan] = []
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    file_plans = iter_file_plans(
+        pdf_files,
+        manifest,
+        incremental,
+        counters,
+        workers=workers,
+        pages_per_task=args.pages_per_task,
+        lexical=lexical,
+        legacy=legacy,
+    )
+
+    if args.dry_run:
+        async for plan, _ in file_plans:
+            plans.append(plan)
+        print_plan(plans, removed, counters["unchanged"])
+        return
+
+    # -------------------------------
+    # ПОТОКОВЫЙ ПАЙПЛАЙН:
+    # чтение PDF -> батчи чанков -> эмбеддинги -> upsert
+    # между стадиями - ограниченные очереди, память не растёт с размером корпуса
+    # -------------------------------
+    if settings.vector_store_backend.lower().strip() == "local":
+        sink = LocalStoreSink()
+    else:
+        sink = PineconeSink()
+
+    chunk_queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    batch_queue: asyncio.Queue = asyncio.Queue(maxsize=CONCURRENCY)
+    record_queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    done_ids: Set[str] = set()
+
+    pbar = tqdm_sync(total=0, desc="Эмбеддинги", unit="chunk")
+
+    async def embed_stage() -> None:
+        try:
+            await asyncio.gather(
+                *(embed_worker(batch_queue, record_queue, pbar) for _ in range(CONCURRENCY))
+            )
+        finally:
+            for _ in range(UPSERT_CONCURRENCY):
+                await record_queue.put(_DONE)
+
+    await asyncio.gather(
+        produce_chunks(file_plans, plans, chunk_queue, pbar),
+        batch_chunks(chunk_queue, batch_queue, CONCURRENCY),
+        embed_stage(),
+        *(upsert_worker(record_queue, sink, done_ids) for _ in range(UPSERT_CONCURRENCY)),
+    )
     pbar.close()
 
-    print(f"Эмбеддингов получено: {len(results)}")
+    total_pending = sum(len(p.pending_ids) for p in plans)
+    print(f"Векторов загружено: {len(done_ids)} из {total_pending}")
+    cache_stats = get_embedding_cache_stats()
+    if cache_stats is not None:
+        print(f"Кеш эмбеддингов: {cache_stats}")
 
     # -------------------------------
-    # 3) ПОДКЛЮЧАЕМСЯ К PINECONE
+    # УДАЛЕНИЕ СИРОТ (укоротившиеся и удалённые файлы)
     # -------------------------------
-    print("Подключаюсь к Pinecone...")
-    index = get_pinecone_index()
-    print("Готово.")
+    delete_ids: List[str] = [vid for plan in plans for vid in plan.to_delete]
+    delete_ids += [vid for e in removed.values() for vid in e.ids]
+    if delete_ids:
+        print(f"Удаляю устаревшие векторы: {len(delete_ids)}")
+        await sink.delete(delete_ids)
+
+    await sink.close()
+
+    if lexical is not None:
+        for vid in delete_ids:
+            lexical.remove(vid)
+        for rel_path in removed:
+            lexical.files.pop(rel_path, None)
+        await asyncio.to_thread(lexical.save, lexical_path)
+        print(f"Лексический индекс (BM25): {len(lexical)} чанков -> {lexical_path}")
 
     # -------------------------------
-    # 4) ЗАГРУЗКА В PINECONE (БАТЧИ)
+    # ОБНОВЛЯЕМ МАНИФЕСТ
+    # (всегда: даже без новых векторов у файлов мог смениться sha256)
     # -------------------------------
-    print("Загружаю в Pinecone...")
-    for i in tqdm_sync(range(0, len(results), BATCH_SIZE), unit="batch", desc="Upsert"):
-        batch = results[i:i + BATCH_SIZE]
-        upsert_with_retry(index, batch)
+    for plan in plans:
+        pending = set(plan.pending_ids)
+        manifest.files[plan.rel_path] = FileEntry(
+            sha256=plan.sha256,
+            # чанки, которые не удалось заэмбеддить/загрузить, помечаем None - повторим в следующий раз
+            chunks=[
+                h if (vid not in pending or vid in done_ids) else None
+                for h, vid in zip(plan.chunk_hashes, plan.ids)
+            ],
+            ids=plan.ids,
+        )
+    for rel_path in removed:
+        manifest.files.pop(rel_path, None)
+    manifest.save(manifest_path)
+
+    if not total_pending and not delete_ids:
+        print("✅ Изменений нет, индекс актуален")
+        return
+
+    # база знаний поменялась - старые LLM-вердикты и результаты больше не актуальны
+    invalidate_verdict_cache()
+    invalidate_result_cache()
+    print("Кеши вердиктов и результатов сброшены.")
 
     print("✅ Индексация завершена")
 
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_sha256(text: str, metadata: dict) -> str:
+    """
+    Хеш чанка учитывает и текст, и metadata: если поменялось описание
+    файла (summary, тип), вектор тоже нужно перезалить.
+    """
+    payload = json.dumps([text, metadata], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class FileEntry:
+    sha256: str
+    # хеш i-го чанка; None - чанк не удалось проиндексировать, повторить
+    chunks: List[Optional[str]] = field(default_factory=list)
+    ids: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Manifest:
+    """
+    Манифест индексации базы знаний.
+
+    Хранит для каждого PDF из data/knowledge хеш содержимого, хеши чанков
+    и id векторов, которые ушли в хранилище. По нему индексатор понимает,
+    какие файлы/чанки изменились, а какие векторы стали сиротами.
+    """
+    files: Dict[str, FileEntry] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path) -> "Manifest":
+        if not path.exists():
+            return cls()
+        try:
+            raw = json.loads(path.read_text(encoding="utf-8"))
+        except Exception as e:
+            print(f"[WARN] Манифест {path} повреждён ({e}), считаю его пустым")
+            return cls()
+        if raw.get("version") != MANIFEST_VERSION:
+            return cls()
+        return cls(
+            files={
+                rel: FileEntry(
+                    sha256=entry["sha256"],
+                    chunks=list(entry.get("chunks", [])),
+                    ids=list(entry.get("ids", [])),
+                )
+                for rel, entry in raw.get("files", {}).items()
+            }
+        )
+
+    def save(self, path: Path) -> None:
+        """
+        Атомарная запись: временный файл + os.replace.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        raw = {
+            "version": MANIFEST_VERSION,
+            "files": {
+                rel: {"sha256": e.sha256, "chunks": e.chunks, "ids": e.ids}
+                for rel, e in sorted(self.files.items())
+            },
+        }
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(json.dumps(raw, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, path)
@@ -0,0 +1,19 @@
+from app.services.dedup import cluster_near_duplicates
+
+CLAUSE = (
+    "Истец при подаче искового заявления уплатил государственную пошлину "
+    "в размере {amount} рублей, что подтверждается платёжным поручением, "
+    "приложенным к настоящему исковому заявлению, в соответствии со статьёй 333.19 "
+    "Налогового кодекса Российской Федерации."
+)
+
+
+def test_near_duplicates_are_clustered():
+    first = CLAUSE.format(amount="300")
+    second = first.replace("приложенным к настоящему", "приложенным к этому")
+    assert cluster_near_duplicates([first, second]) == [[0, 1]]
+
+
+def test_fragments_differing_only_in_a_number_are_not_clustered():
+    fragments = [CLAUSE.format(amount="300"), CLAUSE.format(amount="30000")]
+    assert cluster_near_duplicates(fragments) == [[0], [1]]